@@ -1,12 +1,34 @@
+from collections import OrderedDict
+import hashlib
+import hmac
 import logging
+import os
+import threading
+import time
 
-import boto3
 from botocore.exceptions import ClientError
 
+import clients
+import metrics
+
 # Initialize logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Seconds a looked up api key is trusted before it is fetched again
+api_key_ttl = int(os.environ.get('API_KEY_TTL', 300))
+# Seconds an unknown key id is rejected without asking API Gateway again
+missing_key_ttl = int(os.environ.get('MISSING_API_KEY_TTL', 60))
+# Errors of key ids that can't be looked up, the function may only read the configured key
+# so other ids are denied instead of not found
+missing_key_errors = ('NotFoundException', 'AccessDeniedException', 'BadRequestException')
+# Number of key ids kept, ids come from callers so the cache can't grow with them
+api_key_cache_size = int(os.environ.get('API_KEY_CACHE_SIZE', 256))
+
+# Least recently used api key id to (sha256 digest of key value or None, expiry time)
+api_key_cache = OrderedDict()
+api_key_cache_lock = threading.Lock()
+
 
 def build_auth_policy(effect):
     auth_policy = {
@@ -25,26 +47,82 @@ def build_auth_policy(effect):
     return auth_policy
 
 
-def lambda_handler(event, context):
-    logger.info("Received event.")
-    logger.info(event)
+def digest(value):
+    return hashlib.sha256(value.encode('utf-8')).digest()
 
-    api_client = boto3.client('apigateway')
-    request_key_id = event['queryStringParameters']['id']
-    request_key_value = event['queryStringParameters']['key']
-    auth_policy = build_auth_policy('Deny')
 
-    try:
-        api_key = api_client.get_api_key(
-            apiKey=request_key_id,
-            includeValue=True
-        )
+def cache_digest(key_id, key_digest, expires_at):
+    with api_key_cache_lock:
+        api_key_cache[key_id] = (key_digest, expires_at)
+        api_key_cache.move_to_end(key_id)
+        # Expired entries are dropped first, then the least recently used
+        now = time.monotonic()
+        for cached_id in [cached_id for cached_id, cached in api_key_cache.items() if cached[1] <= now]:
+            del api_key_cache[cached_id]
+        while len(api_key_cache) > api_key_cache_size:
+            api_key_cache.popitem(last=False)
 
-        if api_key['value'] == request_key_value:
-            auth_policy = build_auth_policy('Allow')
+
+def cached_digest(key_id, now):
+    '''
+    Return (True, digest) of a cached key id, or (False, None) if it isn't cached or expired.
+    '''
+    with api_key_cache_lock:
+        cached = api_key_cache.get(key_id)
+        if cached is None:
+            return False, None
+        if cached[1] <= now:
+            del api_key_cache[key_id]
+            return False, None
+        api_key_cache.move_to_end(key_id)
+        return True, cached[0]
+
+
+def get_api_key_digest(key_id):
+    '''
+    Return the digest of the value of an api key, or None if the key doesn't exist, is disabled or can't be read.
+    '''
+    now = time.monotonic()
+    found, key_digest = cached_digest(key_id, now)
+    if found:
+        return key_digest
+
+    try:
+        with metrics.stage('apigateway_get_api_key'):
+            api_key = clients.client('apigateway').get_api_key(
+                apiKey=key_id,
+                includeValue=True
+            )
+        key_digest = digest(api_key['value']) if api_key.get('enabled', True) else None
+        cache_digest(key_id, key_digest, now + api_key_ttl)
 
     except ClientError as e:
-        logger.info(f"Unable to retrieve api key with id {request_key_id}")
+        logger.info(f"Unable to retrieve api key with id {key_id}")
         logger.error(e.response['Error']['Message'])
+        if e.response['Error']['Code'] not in missing_key_errors:
+            raise
+        key_digest = None
+        cache_digest(key_id, key_digest, now + missing_key_ttl)
+
+    return key_digest
+
+
+@metrics.handler('api_authorizer')
+def lambda_handler(event, context):
+    query_strings = event.get('queryStringParameters') or {}
+    request_key_id = query_strings.get('id', '')
+    request_key_value = query_strings.get('key', '')
+    auth_policy = build_auth_policy('Deny')
+
+    if not request_key_id or not request_key_value:
+        return auth_policy
+
+    try:
+        key_digest = get_api_key_digest(request_key_id)
+        if key_digest is not None and hmac.compare_digest(key_digest, digest(request_key_value)):
+            auth_policy = build_auth_policy('Allow')
+
+    except ClientError:
+        logger.error(f"Unable to validate api key with id {request_key_id}")
 
     return auth_policy
@@ -0,0 +1,73 @@
+import os
+import threading
+
+
+# Connections each client keeps open, records, uploads and their parts are sent from several threads
+max_pool_connections = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 16))
+
+# Seconds to connect and to wait for a response, AWS answers in milliseconds so a stuck
+# connection is retried instead of using up the function timeout
+connect_timeout = float(os.environ.get('AWS_CONNECT_TIMEOUT', 2))
+read_timeout = float(os.environ.get('AWS_READ_TIMEOUT', 10))
+
+# Adaptive retries also slow down calls to a service that is throttling them
+retry_mode = os.environ.get('AWS_RETRY_MODE', 'adaptive')
+max_attempts = int(os.environ.get('AWS_MAX_ATTEMPTS', 3))
+
+# AWS clients and resources created so far, reused by later invocations of a warm container
+aws_clients = {}
+aws_clients_lock = threading.RLock()
+
+# Session every client is created from, so credentials are only resolved once
+aws_session = None
+
+
+def session():
+    '''
+    Return the boto3 session of every client, created on first use.
+    '''
+    global aws_session
+    if aws_session is None:
+        # boto3 is a large part of cold start time, so it's only imported once a client is needed
+        import boto3
+
+        with aws_clients_lock:
+            if aws_session is None:
+                aws_session = boto3.session.Session()
+    return aws_session
+
+
+def config():
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=True,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={'mode': retry_mode, 'total_max_attempts': max_attempts}
+    )
+
+
+def get(kind, service_name, region_name=None):
+    key = (kind, service_name, region_name)
+    if key not in aws_clients:
+        # Creating clients isn't thread safe, records can be processed on several threads
+        with aws_clients_lock:
+            if key not in aws_clients:
+                aws_clients[key] = getattr(session(), kind)(service_name, region_name=region_name, config=config())
+    return aws_clients[key]
+
+
+def client(service_name, region_name=None):
+    '''
+    Return the boto3 client for a service, created on first use.
+    '''
+    return get('client', service_name, region_name)
+
+
+def resource(service_name, region_name=None):
+    '''
+    Return the boto3 resource for a service, created on first use.
+    '''
+    return get('resource', service_name, region_name)
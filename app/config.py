@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import clients
+import metrics
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Parameters this function is allowed to read, fetched together in one get_parameters call
+parameter_names = [
+    name.strip() for name in os.environ.get('CONFIG_PARAMETERS', '').split(',') if name.strip()
+]
+
+# Seconds a fetched parameter is served from memory before it is refreshed
+config_ttl = int(os.environ.get('CONFIG_TTL', 300))
+
+parameters = {}
+loaded_at = None
+refresh_lock = threading.Lock()
+
+# Values built from parameters, of (parameter name, build function) to (parameter value, built value)
+derived_values = {}
+
+
+def parse_value(value):
+    '''
+    Parameters are stored by scripts/create_secrets.py as json, fall back to the raw string.
+    '''
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def refresh():
+    '''
+    Fetch every parameter in parameter_names with a single get_parameters call.
+    '''
+    global parameters, loaded_at
+
+    fetched = {}
+    # get_parameters accepts at most 10 names per call
+    for i in range(0, len(parameter_names), 10):
+        with metrics.stage('ssm_get_parameters'):
+            response = clients.client('ssm').get_parameters(Names=parameter_names[i:i + 10], WithDecryption=True)
+        for parameter in response['Parameters']:
+            name, value = parameter['Name'], parse_value(parameter['Value'])
+            # Keep the cached value of an unchanged parameter, so values built from it aren't built again
+            fetched[name] = parameters[name] if parameters.get(name) == value else value
+        if response['InvalidParameters']:
+            logger.error(f"Unable to find ssm parameters {response['InvalidParameters']}")
+
+    parameters = fetched
+    loaded_at = time.monotonic()
+    logger.info(f"Loaded ssm parameters {list(fetched)}")
+
+
+def background_refresh():
+    try:
+        refresh()
+    except Exception as e:
+        logger.error("Failed to refresh ssm parameters, serving cached values")
+        logger.error(e)
+    finally:
+        refresh_lock.release()
+
+
+def get(name, *default):
+    '''
+    Return the value of an ssm parameter, or default if it's given and the parameter doesn't exist.
+    The first call fetches all parameters, later calls are served from memory and
+    trigger a background refresh once the cached values are older than config_ttl.
+    '''
+    if loaded_at is None:
+        with refresh_lock:
+            if loaded_at is None:
+                refresh()
+    elif time.monotonic() - loaded_at > config_ttl and refresh_lock.acquire(blocking=False):
+        threading.Thread(target=background_refresh, daemon=True).start()
+
+    if default and name not in parameters:
+        return default[0]
+    return parameters[name]
+
+
+def get_derived(name, build):
+    '''
+    Return build(value of an ssm parameter), only calling build again after the parameter is refreshed.
+    '''
+    value = get(name)
+    cached = derived_values.get((name, build))
+    if cached is None or cached[0] is not value:
+        cached = (value, build(value))
+        derived_values[(name, build)] = cached
+    return cached[1]
@@ -0,0 +1,104 @@
+import logging
+import math
+import os
+import random
+import time
+
+import fax_job
+import queues
+import store
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+HIGH = 'high'
+NORMAL = 'normal'
+
+# Faxes each from-number may start per minute, and how many it may start at once after being idle
+fax_rate = float(os.environ.get('FAX_RATE_PER_MINUTE', 2)) / 60
+fax_burst = int(os.environ.get('FAX_BURST', 3))
+
+# Tokens of every bucket only high priority faxes may take, less than fax_burst so normal faxes still get sent
+priority_reserve = min(int(os.environ.get('FAX_PRIORITY_RESERVE', 1)), fax_burst - 1)
+
+# Times a token is taken again after another invocation changed the bucket first
+max_conflicts = 5
+
+# Queue of each priority lane, both trigger SendFaxFunction
+lanes = {
+    HIGH: queues.get_queue('SEND_FAX_PRIORITY_QUEUE_URL'),
+    NORMAL: queues.get_queue('SEND_FAX_QUEUE_URL'),
+}
+
+# Token bucket of every from-number, tokens are stored in thousandths so they stay integers
+bucket_table = store.get_table('DISPATCH_TABLE')
+
+
+def lane(job):
+    return lanes.get(job.priority, lanes[NORMAL])
+
+
+def take_token(number, reserve):
+    '''
+    Take a token from the bucket of a from-number, leaving at least reserve tokens in it.
+    Returns 0 if a token was taken, otherwise the seconds until one is available.
+    '''
+    capacity = fax_burst * 1000
+    needed = (reserve + 1) * 1000
+
+    for _ in range(max_conflicts):
+        now = int(time.time() * 1000)
+        item = bucket_table.get(number)
+        if item is None:
+            tokens, version = capacity, 0
+        else:
+            refilled = int((now - int(item['updated_at'])) * fax_rate)
+            tokens, version = min(capacity, int(item['tokens']) + refilled), int(item['version'])
+
+        if tokens < needed:
+            return (needed - tokens) / 1000 / fax_rate
+
+        saved = bucket_table.put(number, {
+            'tokens': tokens - 1000,
+            'updated_at': now,
+            'version': version + 1,
+            # A bucket that has refilled is the same as no bucket
+            'expires_at': now // 1000 + math.ceil(fax_burst / fax_rate)
+        }, version=version)
+        if saved:
+            return 0
+
+    # Other invocations keep emptying this bucket, try again once a token has refilled
+    return 1 / fax_rate
+
+
+def submit(jobs):
+    '''
+    Queue fax jobs on the lane of their priority.
+    '''
+    for priority, queue in lanes.items():
+        lane_jobs = [job for job in jobs if lane(job) is queue]
+        if lane_jobs:
+            logger.info(f"Queueing {len(lane_jobs)} {priority} priority faxes")
+            fax_job.send_jobs(queue, lane_jobs)
+
+
+def acquire(job):
+    '''
+    Take a token to send a fax from the from-number of a job.
+    Returns 0 if the fax can be sent now, otherwise the seconds to wait.
+    '''
+    reserve = 0 if job.priority == HIGH else priority_reserve
+    return take_token(job.from_number, reserve)
+
+
+def defer(job, wait):
+    '''
+    Queue a job again, delivered once its from-number should have a token.
+    Jitter spreads the jobs waiting for one number over a refill period, so they don't all wake up together.
+    '''
+    delay = min(queues.max_delay_seconds, math.ceil(wait + random.uniform(0, 1 / fax_rate)))
+    logger.info(f"Deferring fax from {job.from_number} to {job.to_number} by {delay} seconds")
+    fax_job.send_jobs(lane(job), [job], delay_seconds=delay)
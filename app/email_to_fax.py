@@ -1,202 +1,435 @@
-import base64
-import email
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import closing
+import email.utils
+import hashlib
+import itertools
 import logging
-import json
 import os
-import urllib
+import tempfile
 
-import boto3
+from boto3.exceptions import S3UploadFailedError
 from botocore.exceptions import ClientError
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioRestException
+
+import clients
+import config
+import dispatch
+import fax_job
+import idempotency
+import ledger
+import metrics
+import mime_stream
+import notify
+import pdf_preflight
+import phone_numbers
+import records
+import s3_stream
 
 # Initialize logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize aws clients
-s3_client = boto3.client('s3')
-ssm_client = boto3.client('ssm')
-ses_client = boto3.client('ses')
+# Uploads of pdf attachments run on this pool, shared by every email in an invocation
+upload_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('UPLOAD_WORKERS', 4)))
 
-# Get ssm parameters
-admin_email = ssm_client.get_parameter(Name='/prod/admin_email', WithDecryption=True)
-aws_email = ssm_client.get_parameter(Name='/prod/aws_email', WithDecryption=True)
-fax_emails_resp = ssm_client.get_parameter(Name='/prod/fax_emails', WithDecryption=True)
-fax_emails = json.loads(fax_emails_resp['Parameter']['Value'])
-twilio_ssm_response = ssm_client.get_parameter(Name='/prod/twilio', WithDecryption=True)
-twilio_params = json.loads(twilio_ssm_response['Parameter']['Value'])
+# 'separate' sends every pdf attachment as its own fax, 'merge' combines them into one fax
+attachment_mode = os.environ.get('ATTACHMENT_MODE', 'separate')
 
+# 'optimize' rejects unreadable pdf attachments and shrinks their images for faxing before they are saved,
+# 'check' only rejects unreadable ones, 'off' streams them to S3 unchanged while they are decoded
+preflight_mode = os.environ.get('PDF_PREFLIGHT', 'optimize')
 
-def check_number(to_phone):
-    twilio_client = Client(twilio_params['twilio_account_id'], twilio_params['twilio_api_key'])
-    try:
-        twilio_client.lookups.phone_numbers(to_phone).fetch()
-        return True
-    except TwilioRestException:
-        return False
+
+def normalize_email(address):
+    '''
+    Lowercase an email address and remove plus addressing, so name+fax@example.com matches name@example.com.
+    '''
+    local, _, domain = address.strip().lower().rpartition('@')
+    return f"{local.split('+', 1)[0]}@{domain}" if local else domain
+
+
+def build_sender_index(fax_emails):
+    '''
+    Build a map of normalized email to the fax numbers it may send from,
+    from the /prod/fax_emails map of fax number to one email or a list of emails.
+    '''
+    sender_index = {}
+    for from_number, emails in fax_emails.items():
+        if isinstance(emails, str):
+            emails = [emails]
+        for address in emails:
+            sender_index.setdefault(normalize_email(address), []).append(from_number)
+    return sender_index
 
 
 def check_from_email(from_email):
-    from_number = False
-    for item in fax_emails.items():
-        if from_email in item:
-            from_number = item[0]
-            break
-    return from_number
+    '''
+    Return the first fax number the sender may send from, or False if the sender isn't approved.
+    '''
+    sender_index = config.get_derived('/prod/fax_emails', build_sender_index)
+    from_numbers = sender_index.get(normalize_email(from_email))
+    return from_numbers[0] if from_numbers else False
+
+
+def pdf_name(object_key, part):
+    '''
+    Name of a pdf attachment in SendFax bucket, of the email's object key and the hash of the pdf,
+    or its position when attachments are streamed without a preflight.
+    The same every time an email is processed, so a retry overwrites the objects of an earlier attempt.
+    '''
+    return f"{object_key}/{part}.pdf"
+
 
+def content_hash(pdf_file):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: pdf_file.read(1024 * 1024), b''):
+        digest.update(chunk)
+    pdf_file.seek(0)
+    return digest.hexdigest()
 
-def send_email(recipient, sender, subject, charset, body_html, body_text):
-    logger.info(f"Attempting to send email to {recipient} with subject: {subject}")
+
+class PdfBuffer:
+    '''
+    Collects an attachment in a temporary file, which is moved to /tmp once it's larger than 1 MB.
+    '''
+
+    def __init__(self, part):
+        self.filename = part.get_filename()
+        self.file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.seek(0)
+
+    def abort(self):
+        self.file.close()
+
+
+def prepare_pdf(buffer):
+    '''
+    Run the preflight on an attachment, returns (file to upload, page count).
+    The optimized copy is only uploaded when it's smaller than the attachment.
+    Raises pdf_preflight.PreflightError if the attachment can't be faxed.
+    '''
+    if preflight_mode == 'check':
+        return buffer.file, pdf_preflight.check(buffer.file)
+
+    optimized = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
     try:
-        ses_client.send_email(
-            Destination={
-                'ToAddresses': [
-                    recipient,
-                ],
-            },
-            Message={
-                'Body': {
-                    'Html': {
-                        'Charset': charset,
-                        'Data': body_html,
-                    },
-                    'Text': {
-                        'Charset': charset,
-                        'Data': body_text,
-                    },
-                },
-                'Subject': {
-                    'Charset': charset,
-                    'Data': subject,
-                },
-            },
-            Source=sender,
+        with metrics.stage('pdf_preflight'):
+            pages = pdf_preflight.optimize(buffer.file, optimized)
+    except Exception:
+        optimized.close()
+        raise
+
+    # Dithered scans and photos can compress worse in black and white than the original
+    original_size = buffer.file.seek(0, 2)
+    if optimized.tell() >= original_size:
+        logger.info(f"Keeping the original PDF, {original_size} bytes, optimized copy isn't smaller")
+        optimized.close()
+        buffer.file.seek(0)
+        return buffer.file, pages
+
+    optimized.seek(0)
+    return optimized, pages
+
+
+def upload_pdf(pdf_file, send_fax_bucket, name, metadata):
+    clients.client('s3').upload_fileobj(
+        pdf_file,
+        send_fax_bucket,
+        name,
+        ExtraArgs={
+            'ACL': 'private',
+            'ContentType': 'application/pdf',
+            'Metadata': metadata
+        }
+    )
+
+
+def stream_pdfs(msg, send_fax_bucket, object_key, metadata):
+    '''
+    Stream every pdf attachment into its own object without a preflight.
+    Uploads run on upload_executor while the rest of the email is parsed.
+    Returns a list of (object key, attachment filename, page count), page counts are unknown.
+    '''
+    index = itertools.count()
+
+    def open_pdf(part):
+        name = pdf_name(object_key, next(index))
+        logger.info(f"Creating pdf file name {name}")
+        return s3_stream.S3MultipartWriter(
+            clients.client('s3'),
+            send_fax_bucket,
+            name,
+            executor=upload_executor,
+            ACL='private',
+            ContentType='application/pdf',
+            Metadata=dict(metadata, filename=part.get_filename() or name),
         )
-        logger.info(f"Email sent successfully")
 
-    except ClientError as e:
-        logger.error(f"Email failed to send")
-        logger.error(e)
+    writers = msg.extract('application/pdf', open_pdf)
 
+    errors = []
+    for writer in writers:
+        try:
+            writer.result()
+        except Exception as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
 
-# --------------- Main handler ------------------
-def lambda_handler(event, context):
-    logger.info("Received event.")
-    logger.info(event)
-
-    # Get the object from the event.
-    email_to_fax_bucket = event['Records'][0]['s3']['bucket']['name']
-    object_key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'])
-    s3_response = s3_client.get_object(Bucket=email_to_fax_bucket, Key=object_key,)
-    msg = email.message_from_bytes(s3_response['Body'].read())
-    from_email = email.utils.parseaddr(msg['From'])[1]
-    date = email.utils.parsedate_to_datetime(msg['Date']).date().strftime("%Y-%d-%m")
-    time = email.utils.parsedate_to_datetime(msg['Date']).time().strftime("%H:%M:%S")
-    to_phone = msg['Subject']
+    return [(writer.object_key, writer.extra_args['Metadata']['filename'], '') for writer in writers]
+
+
+def save_pdfs(msg, send_fax_bucket, object_key, metadata):
+    '''
+    Save every pdf attachment into its own object, each one is sent as a separate fax.
+    Attachments are uploaded on upload_executor while the next one goes through the preflight.
+    Returns a list of (object key, attachment filename, page count) and a list of rejected filenames.
+    '''
+    if preflight_mode == 'off':
+        return stream_pdfs(msg, send_fax_bucket, object_key, metadata), []
+
+    buffers = msg.extract('application/pdf', PdfBuffer)
+    pdfs = []
+    rejected = []
+    files = []
+    uploads = []
+    try:
+        for index, buffer in enumerate(buffers):
+            filename = buffer.filename or f"attachment {index + 1}"
+            try:
+                pdf_file, pages = prepare_pdf(buffer)
+            except pdf_preflight.PreflightError as e:
+                logger.warning(f"Rejected attachment {filename}: {e}")
+                rejected.append(filename)
+                continue
+
+            files.append(pdf_file)
+            name = pdf_name(object_key, content_hash(pdf_file))
+            if any(name == saved[0] for saved in pdfs):
+                logger.info(f"Skipping attachment {filename}, it's the same as an earlier one")
+                continue
+
+            logger.info(f"Creating pdf file name {name} with {pages} pages")
+            uploads.append(upload_executor.submit(
+                upload_pdf, pdf_file, send_fax_bucket, name, dict(metadata, filename=filename, pages=str(pages))
+            ))
+            pdfs.append((name, filename, str(pages)))
+
+        for upload in uploads:
+            upload.result()
+    finally:
+        wait(uploads)
+        for pdf_file in files:
+            pdf_file.close()
+        for buffer in buffers:
+            buffer.abort()
+
+    return pdfs, rejected
+
+
+def merge_pdfs(pdf_files):
+    # pypdf is only needed when attachments are merged
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for pdf_file in pdf_files:
+        writer.append(pdf_file)
+    merged = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    writer.write(merged)
+    merged.seek(0)
+    return merged
+
+
+def save_merged_pdf(msg, send_fax_bucket, object_key, metadata):
+    '''
+    Combine every pdf attachment into one object, which is sent as a single fax.
+    Returns a list of (object key, first attachment filename, page count) and a list of rejected filenames.
+    '''
+    buffers = msg.extract('application/pdf', PdfBuffer)
+    filenames = []
+    rejected = []
+    files = []
+    pages = 0
+    try:
+        for index, buffer in enumerate(buffers):
+            filename = buffer.filename or f"attachment {index + 1}"
+            if preflight_mode == 'off':
+                files.append(buffer.file)
+                filenames.append(filename)
+                continue
+            try:
+                pdf_file, count = prepare_pdf(buffer)
+            except pdf_preflight.PreflightError as e:
+                logger.warning(f"Rejected attachment {filename}: {e}")
+                rejected.append(filename)
+                continue
+            files.append(pdf_file)
+            filenames.append(filename)
+            pages += count
+
+        if not files:
+            return [], rejected
+
+        pdf_file = files[0]
+        if len(files) > 1:
+            pdf_file = merge_pdfs(files)
+            files.append(pdf_file)
+        name = pdf_name(object_key, content_hash(pdf_file))
+        logger.info(f"Creating pdf file name {name} from {len(filenames)} attachments")
+        page_count = str(pages) if pages else ''
+        upload_pdf(pdf_file, send_fax_bucket, name, dict(metadata, filename=filenames[0], pages=page_count))
+    finally:
+        for pdf_file in files:
+            pdf_file.close()
+        for buffer in buffers:
+            buffer.abort()
+
+    return [(name, filenames[0], page_count)], rejected
+
+
+def email_priority(headers):
+    '''
+    Faxes of emails the sender marked as important go to the high priority lane.
+    '''
+    x_priority = headers.get('X-Priority', '').strip()
+    importance = headers.get('Importance', '').strip().lower()
+    priority = headers.get('Priority', '').strip().lower()
+    if x_priority[:1] in ('1', '2') or importance == 'high' or priority == 'urgent':
+        return dispatch.HIGH
+    return dispatch.NORMAL
+
+
+def process_email(email_to_fax_bucket, object_key):
+    '''
+    Save the PDF attached to an email in EmailToFaxBucket into SendFaxBucket.
+    '''
+    with metrics.stage('s3_get'):
+        s3_response = clients.client('s3').get_object(Bucket=email_to_fax_bucket, Key=object_key,)
+    with closing(s3_response['Body']) as body:
+        return process_message(email_to_fax_bucket, object_key, mime_stream.MimeStream(body))
+
+
+def process_email_once(email_to_fax_bucket, object_key):
+    # S3 can send an event more than once, SES names emails by message id so every email is faxed once
+    key = f"email_to_fax#{email_to_fax_bucket}/{object_key}"
+    return idempotency.run_once(key, process_email, email_to_fax_bucket, object_key)
+
+
+def process_message(email_to_fax_bucket, object_key, msg):
+    '''
+    Check the sender and destination of an email, then save its PDFs into SendFaxBucket.
+    Only the email headers are in memory, attachments are decoded as the email is read from S3
+    and spooled to /tmp for their preflight.
+    '''
+    from_email = email.utils.parseaddr(msg.headers['From'])[1]
+    date = email.utils.parsedate_to_datetime(msg.headers['Date']).date().strftime("%Y-%m-%d")
+    time = email.utils.parsedate_to_datetime(msg.headers['Date']).time().strftime("%H:%M:%S")
+    to_phone = phone_numbers.normalize_number(msg.headers['Subject'])
     from_phone = check_from_email(from_email)
 
     # Check if sender is not in the approved senders list
     # If not, log sender address and send email to admin
     if from_phone is False:
         logger.warn(f"Received email from unapproved sender: {from_email}")
-        sender = aws_email['Parameter']['Value'].strip('/"')
-        recipient = admin_email['Parameter']['Value'].strip('/"')
-        subject = "Received email from non-approved sender"
-        charset = "utf-8"
-        body_text = (
-            f"You have recieved an email from non approved sender: {from_email}. "
-            f"The message is in the {email_to_fax_bucket} bucket, named {object_key}."
+        notify.send(
+            notify.UNAPPROVED_SENDER,
+            [config.get('/prod/admin_email')],
+            {'from_email': from_email, 'bucket': email_to_fax_bucket, 'object_key': object_key},
+            config.get('/prod/aws_email')
         )
-        body_html = f"""
-            <html>
-            <head></head>
-            <body>
-            <p>{body_text}</p>
-            </body>
-            </html>
-            """
-        send_email(recipient, sender, subject, charset, body_html, body_text)
 
         return False
 
     # Check if phone number is valid
     # If not, log sender phone nmumber and send email to sender
-    number_valid = check_number(to_phone)
+    number_valid = phone_numbers.check_number(to_phone)
     if number_valid is False:
         logger.warn(f"Unable to verify destination fax number: {to_phone}")
-        sender = aws_email['Parameter']['Value'].strip('/"')
-        recipient = admin_email['Parameter']['Value'].strip('/"')
-        subject = f"RE: {to_phone}"
-        charset = "utf-8"
-        body_text = (
-            f"We were unable to verify the destination fax number: {to_phone}. "
-            f"Please review the number and send again."
+        notify.send(
+            notify.INVALID_NUMBER,
+            [config.get('/prod/admin_email')],
+            {'to_phone': to_phone},
+            config.get('/prod/aws_email')
         )
-        body_html = f"""
-            <html>
-            <head></head>
-            <body>
-            <p>{body_text}</p>
-            </body>
-            </html>
-            """
-        send_email(recipient, sender, subject, charset, body_html, body_text)
 
         return False
 
-    # Parse msg object, if pdf exists, save to SendFax bucket
-    for part in msg.walk():
-        if part.get_content_type() == 'application/pdf':
-            filename = part.get_filename()
-            pdf_name = "_".join([from_email, date, time]) + ".pdf"
-            pdf_object = base64.b64decode(part.get_payload())
-            send_fax_bucket = os.environ['BUCKET_NAME']
-            try:
-                logger.info(f"Creating pdf file name {pdf_name}")
-                s3_client.put_object(
-                    ACL='private',
-                    Body=pdf_object,
-                    Bucket=send_fax_bucket,
-                    ContentType='application/pdf',
-                    Key=pdf_name,
-                    Metadata={
-                        'from_email': from_email,
-                        'from_phone': from_phone,
-                        'to_phone': to_phone,
-                        'date': date,
-                        'time': time,
-                        'filename': filename
-                    },
-                )
-                logger.info(f"Successfully saved pdf to {send_fax_bucket} bucket.")
-
-                return True
-
-            except ClientError as e:
-                logger.error(f"Failed to save PDF to S3 bucket {send_fax_bucket}")
-                logger.error(e)
-
-                return False
-
-        # If pdf doesn't exist send email to sender.
-        else:
-            logger.warn("Recieved email with no PDF, notifying sender")
-
-            # Notify admin that an email was received by non approved sender
-            sender = aws_email['Parameter']['Value'].strip('/"')
-            recipient = email.utils.parseaddr(msg['From'])[1]
-            subject = "Recieved email with no PDF"
-            charset = "utf-8"
-            body_text = f"Recieved email with subject {to_phone} on {date} at {time} with no PDF.  No fax sent."
-            body_html = f"""
-                <html>
-                <head></head>
-                <body>
-                <p>{body_text}</p>
-                </body>
-                </html>
-                """
-            send_email(recipient, sender, subject, charset, body_html, body_text)
-
-            return False
+    # Save every pdf attachment that passes the preflight, if one exists, into SendFax bucket
+    send_fax_bucket = os.environ['BUCKET_NAME']
+    metadata = {
+        'from_email': from_email,
+        'from_phone': from_phone,
+        'to_phone': to_phone,
+        'date': date,
+        'time': time
+    }
+
+    try:
+        # Parsing reads the email from S3 as it goes, so this includes the preflight and uploads of attachments
+        with metrics.stage('mime_parse'):
+            if attachment_mode == 'merge':
+                pdfs, rejected = save_merged_pdf(msg, send_fax_bucket, object_key, metadata)
+            else:
+                pdfs, rejected = save_pdfs(msg, send_fax_bucket, object_key, metadata)
+    except (ClientError, S3UploadFailedError) as e:
+        logger.error(f"Failed to save PDF to S3 bucket {send_fax_bucket}")
+        logger.error(e)
+
+        raise
+
+    if pdfs:
+        logger.info(f"Successfully saved {len(pdfs)} pdf to {send_fax_bucket} bucket.")
+
+        # Hand the faxes to SendFaxFunction
+        jobs = [
+            fax_job.FaxJob(
+                bucket=send_fax_bucket,
+                object_key=pdf_key,
+                from_number=from_phone,
+                to_number=to_phone,
+                from_email=from_email,
+                filename=filename,
+                pages=pages,
+                priority=email_priority(msg.headers)
+            )
+            for pdf_key, filename, pages in pdfs
+        ]
+        dispatch.submit(jobs)
+        for job in jobs:
+            ledger.record_job(job, ledger.OUTBOUND, ledger.SUBMITTED, email=from_email, priority=job.priority)
+
+    # Tell the sender which attachments couldn't be read, after the others are queued
+    if rejected:
+        logger.warning(f"Rejected {len(rejected)} pdf attachments, notifying sender")
+        notify.send(
+            notify.INVALID_PDF,
+            [from_email],
+            {'to_phone': to_phone, 'filenames': ', '.join(rejected)},
+            config.get('/prod/aws_email')
+        )
+
+    if pdfs:
+        return True
+    if rejected:
+        return False
+
+    # If pdf doesn't exist send email to sender.
+    logger.warn("Recieved email with no PDF, notifying sender")
+    notify.send(
+        notify.NO_PDF,
+        [from_email],
+        {'to_phone': to_phone, 'date': date, 'time': time},
+        config.get('/prod/aws_email')
+    )
+
+    return False
+
+
+# --------------- Main handler ------------------
+@metrics.handler('email_to_fax')
+def lambda_handler(event, context):
+    return records.process_s3_objects(event, process_email_once)
@@ -0,0 +1,217 @@
+import base64
+from datetime import date, datetime, timedelta, timezone
+import hashlib
+import json
+import logging
+import os
+
+from botocore.exceptions import ClientError
+
+import ledger
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Events returned per page when the request doesn't ask for fewer
+default_page_size = int(os.environ.get('HISTORY_PAGE_SIZE', 50))
+max_page_size = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 100))
+
+# Ledger queries of one request, filters can leave queries with few events so pages end early instead of reading on
+max_reads = 5
+
+# Days of the ledger read without a number, direction or status to narrow it down
+default_days = 7
+max_days = 31
+
+# Seconds clients may reuse a page, new events only change the first page
+max_age = int(os.environ.get('HISTORY_MAX_AGE', 30))
+
+# Ledger attributes left out of the response
+internal_attributes = ('day', 'expires_at')
+
+invalid_cursor = "cursor is invalid, pass the cursor of the previous page unchanged"
+
+
+class BadRequest(Exception):
+    '''
+    Raised for query string parameters that can't be used.
+    '''
+
+
+def parse_date(value, name):
+    '''
+    Check a date or timestamp parameter, returns it unchanged since the ledger compares them as strings.
+    '''
+    try:
+        date.fromisoformat(value[:10])
+    except ValueError:
+        raise BadRequest(f"{name} must be a date like 2024-01-31 or an ISO 8601 UTC timestamp")
+    return value
+
+
+def parse_page_size(value):
+    try:
+        limit = int(value)
+    except ValueError:
+        raise BadRequest("limit must be a number")
+    if not 1 <= limit <= max_page_size:
+        raise BadRequest(f"limit must be between 1 and {max_page_size}")
+    return limit
+
+
+def encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(value):
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+    except ValueError:
+        raise BadRequest(invalid_cursor)
+    if not isinstance(cursor, dict):
+        raise BadRequest(invalid_cursor)
+    return cursor
+
+
+def check_key(index, value, key):
+    '''
+    Check that a ledger cursor from a request only holds the key attributes of the partition being read,
+    since it is passed to DynamoDB as the key to continue after.
+    '''
+    partition, sort = ledger.indexes[index]
+    if key is None:
+        return None
+    if (not isinstance(key, dict) or set(key) != {'pk', partition, sort}
+            or not all(isinstance(attribute, str) for attribute in key.values()) or key[partition] != value):
+        raise BadRequest(invalid_cursor)
+    return key
+
+
+def read_index(index, value, start, end, limit, cursor, filters):
+    '''
+    Read up to limit events of one index partition, newest first.
+    Returns the events and the ledger cursor to continue after them, or None after the last event.
+    '''
+    cursor = check_key(index, value, cursor)
+    events = []
+    for _ in range(max_reads):
+        items, cursor = ledger.lookup(
+            index, value, start=start, end=end, limit=limit - len(events), cursor=cursor, **filters
+        )
+        events.extend(items)
+        if cursor is None or len(events) == limit:
+            break
+    return events, cursor
+
+
+def read_days(start, end, limit, cursor, filters):
+    '''
+    Read up to limit events of the day index, newest day first.
+    The cursor names the day to continue on, as the ledger cursor only covers one day.
+    '''
+    last = date.fromisoformat(end[:10])
+    first = date.fromisoformat(start[:10]) if start else last - timedelta(days=default_days - 1)
+    if (last - first).days >= max_days:
+        raise BadRequest(f"Filter by number, direction or status to read more than {max_days} days")
+
+    try:
+        day = date.fromisoformat(cursor['day']) if cursor else last
+    except (KeyError, TypeError, ValueError):
+        raise BadRequest(invalid_cursor)
+    if cursor and set(cursor) != {'day', 'key'}:
+        raise BadRequest(invalid_cursor)
+    key = check_key('day', day.isoformat(), cursor['key']) if cursor else None
+    events = []
+    # Days without events take a read each
+    for _ in range(max_reads + max_days):
+        if day < first or len(events) == limit:
+            break
+        items, key = ledger.lookup(
+            'day', day.isoformat(), start=start, end=end, limit=limit - len(events), cursor=key, **filters
+        )
+        events.extend(items)
+        if key is None:
+            day -= timedelta(days=1)
+
+    if day < first:
+        return events, None
+    return events, {'day': day.isoformat(), 'key': key}
+
+
+def query(params):
+    '''
+    Return a page of fax events matching the query string parameters of a request, newest first:
+    number (this account's line), direction, status, from and to (dates or timestamps), limit and cursor.
+    '''
+    number = params.get('number')
+    direction = params.get('direction')
+    status = params.get('status')
+    if direction not in (None, ledger.OUTBOUND, ledger.INBOUND):
+        raise BadRequest(f"direction must be {ledger.OUTBOUND} or {ledger.INBOUND}")
+
+    start = parse_date(params['from'], 'from') if params.get('from') else None
+    end = parse_date(params['to'], 'to') if params.get('to') else None
+    limit = parse_page_size(params['limit']) if params.get('limit') else default_page_size
+    cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+
+    # Query the most selective index and filter on the others
+    keys = {'line': number, 'status': status, 'direction': direction}
+    index = next((name for name, value in keys.items() if value), None)
+    filters = {name: value for name, value in keys.items() if value and name != index}
+
+    try:
+        if index is None:
+            end = end or datetime.now(timezone.utc).date().isoformat()
+            events, cursor = read_days(start, end, limit, cursor, filters)
+        else:
+            events, cursor = read_index(index, keys[index], start, end, limit, cursor, filters)
+    except ClientError as e:
+        # DynamoDB rejects a start key outside the queried range, a cursor of another query
+        if cursor and e.response['Error']['Code'] == 'ValidationException':
+            raise BadRequest(invalid_cursor)
+        raise
+
+    return {
+        'faxes': [
+            {name: value for name, value in event.items() if name not in internal_attributes}
+            for event in events
+        ],
+        'cursor': encode_cursor(cursor) if cursor else None
+    }
+
+
+def get_header(event, name):
+    # REST APIs keep the case of header names
+    headers = event.get('headers') or {}
+    return next((value for key, value in headers.items() if key.lower() == name), None)
+
+
+def handle(event):
+    '''
+    Serve GET /fax/history with an ETag, returns 304 if it matches If-None-Match.
+    '''
+    try:
+        page = query(event.get('queryStringParameters') or {})
+    except BadRequest as e:
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": 'application/json'},
+            "body": json.dumps({"message": str(e)})
+        }
+
+    body = json.dumps(page, separators=(',', ':'))
+    etag = f'"{hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]}"'
+    headers = {
+        "Content-Type": 'application/json',
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={max_age}"
+    }
+
+    if_none_match = get_header(event, 'if-none-match')
+    if if_none_match and {etag, '*'} & {tag.strip() for tag in if_none_match.split(',')}:
+        return {"statusCode": 304, "headers": headers, "body": ""}
+
+    logger.info(f"Returned {len(page['faxes'])} fax events")
+    return {"statusCode": 200, "headers": headers, "body": body}
@@ -0,0 +1,34 @@
+from dataclasses import asdict, dataclass
+import json
+
+
+@dataclass
+class FaxJob:
+    '''
+    Everything needed to send or deliver a fax saved in S3, passed between functions in SQS messages
+    so the consumer doesn't need to read the object metadata.
+    '''
+    bucket: str
+    object_key: str
+    from_number: str
+    to_number: str
+    from_email: str = ''
+    filename: str = ''
+    pages: str = ''
+    fax_sid: str = ''
+    priority: str = 'normal'
+    attempt: int = 1
+
+    def to_json(self):
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, body):
+        return cls(**json.loads(body))
+
+
+def send_jobs(queue, jobs, delay_seconds=0):
+    '''
+    Queue fax jobs on a queue from queues.get_queue, raises if any of them couldn't be queued.
+    '''
+    queue.send([job.to_json() for job in jobs], delay_seconds)
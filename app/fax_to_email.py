@@ -1,40 +1,32 @@
-import json
 import logging
 import os
-import urllib
 
-import boto3
-from botocore.exceptions import ClientError
+import clients
+import config
+import fax_job
+import idempotency
+import ledger
+import metrics
+import notify
+import records
+import store
 
 
 # Initialize logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# 'immediate' sends one email per fax, 'digest' buffers faxes per recipient and sends them together
+digest_mode = os.environ.get('DIGEST_MODE', 'immediate')
+# Number of buffered faxes that flushes a recipient's digest before the scheduled flush
+digest_max_faxes = int(os.environ.get('DIGEST_MAX_FAXES', 20))
+# Faxes waiting to be sent, of recipient email to a list of faxes
+digest_table = store.get_table('DIGEST_TABLE')
 
-def lambda_handler(event, context):
-    '''
-    Send any PDF uploaded to S3 bucket ReceiveFaxBucket to a specific email.
-    '''
-    logger.info("Received event.")
-    logger.info(event)
-
-    # Fetch ssm parameters
-    ssm_client = boto3.client('ssm')
-    ssm_params = ssm_client.get_parameter(Name='/prod/fax_to_email', WithDecryption=True)
-    json_params = json.loads(ssm_params['Parameter']['Value'])
-
-    # Get the object from the event.
-    bucket_name = event['Records'][0]['s3']['bucket']['name']
-    object_key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'])
-
-    # Get fax metadata
-    s3 = boto3.resource('s3')
-    fax_metadata = s3.Object(bucket_name, object_key).metadata
 
+def create_media_url(bucket_name, object_key):
     # Generate presigned url
-    s3_client = boto3.client('s3')
-    media_url = s3_client.generate_presigned_url(
+    return clients.client('s3').generate_presigned_url(
         'get_object',
         Params={
             'Bucket': bucket_name,
@@ -43,66 +35,114 @@ def lambda_handler(event, context):
         ExpiresIn=604800
     )
 
-    # Create email parameters
-    SENDER = json_params['source_email']
-    RECIPIENT = json_params['destination_email']
-    SUBJECT = f"New fax from: {fax_metadata['from_number']}"
-    CHARSET = "utf-8"
-    BODY_TEXT = (
-        "You have received a new fax!"
-        f"From: {fax_metadata['from_number']}\n"
-        f"To: {fax_metadata['to_number']}\n"
-        f"Pages: {fax_metadata['pages']}\n\n"
-        "To view or download please go to the url below, this link will be active for 7 days.\n"
-        f"{media_url}"
+
+def process_job(job):
+    '''
+    Send a PDF saved in S3 bucket ReceiveFaxBucket to the emails routed from its fax number.
+    '''
+    # Fetch ssm parameters
+    json_params = config.get('/prod/fax_to_email')
+    recipients = notify.get_recipients(job.to_number)
+
+    if digest_mode == 'digest':
+        fax = {
+            'bucket': job.bucket,
+            'object_key': job.object_key,
+            'from_number': job.from_number,
+            'to_number': job.to_number,
+            'pages': job.pages,
+            'fax_sid': job.fax_sid
+        }
+        for recipient in recipients:
+            if digest_table.append(recipient, 'faxes', fax) >= digest_max_faxes:
+                # The fax is already buffered, failing the record would buffer it again on redelivery
+                try:
+                    send_digest(recipient)
+                except Exception as e:
+                    logger.error(f"Failed to send digest to {recipient}, the scheduled flush will retry it")
+                    logger.error(e)
+        return
+
+    # Send email to everyone the receiving number is routed to
+    notify.send(
+        notify.FAX_RECEIVED,
+        recipients,
+        {
+            'from_number': job.from_number,
+            'to_number': job.to_number,
+            'pages': job.pages,
+            'media_url': create_media_url(job.bucket, job.object_key)
+        },
+        json_params['source_email']
     )
+    ledger.record_job(job, ledger.INBOUND, ledger.EMAILED, recipients=len(recipients))
 
-    BODY_HTML = f"""
-    <html>
-    <head></head>
-    <body>
-    <h1>Email Verification Receipt</h1>
-    <p>You have received a new fax!</p>
-    <p>From: {fax_metadata['from_number']}</p>
-    <p>To: {fax_metadata['to_number']}</p>
-    <p>Pages: {fax_metadata['pages']}</p>
-    <p>To view or download please go to the url below, this link will be active for 7 days.</p>
-    <p>{media_url}</p>
-    </body>
-    </html>
-    """
-
-    # Create a new SES resource and specify a region.
-    ses_client = boto3.client('ses', os.environ['AWS_REGION'])
-
-    # Try to send the email.
+
+def send_digest(recipient):
+    '''
+    Send every fax buffered for a recipient in one email.
+    The buffer is removed before sending, so a concurrent flush can't send it twice.
+    '''
+    item = digest_table.pop(recipient)
+    if not item or not item.get('faxes'):
+        return
+
+    faxes = [
+        {
+            'from_number': fax['from_number'],
+            'to_number': fax['to_number'],
+            'pages': fax['pages'],
+            'media_url': create_media_url(fax['bucket'], fax['object_key'])
+        }
+        for fax in item['faxes']
+    ]
+    logger.info(f"Sending digest of {len(faxes)} faxes to {recipient}")
     try:
-        response = ses_client.send_email(
-            Destination={
-                'ToAddresses': [
-                    RECIPIENT,
-                ],
-            },
-            Message={
-                'Body': {
-                    'Html': {
-                        'Charset': CHARSET,
-                        'Data': BODY_HTML,
-                    },
-                    'Text': {
-                        'Charset': CHARSET,
-                        'Data': BODY_TEXT,
-                    },
-                },
-                'Subject': {
-                    'Charset': CHARSET,
-                    'Data': SUBJECT,
-                },
-            },
-            Source=SENDER,
+        notify.send(
+            notify.FAX_DIGEST,
+            [recipient],
+            {'count': len(faxes), 'faxes': faxes},
+            config.get('/prod/fax_to_email')['source_email']
+        )
+    except Exception:
+        # Put the faxes back so the next flush retries them
+        for fax in item['faxes']:
+            digest_table.append(recipient, 'faxes', fax)
+        raise
+
+    for fax in item['faxes']:
+        ledger.record(
+            # Faxes buffered before the ledger existed have no fax sid
+            fax.get('fax_sid') or fax['object_key'],
+            ledger.INBOUND,
+            ledger.EMAILED,
+            fax['to_number'],
+            fax['from_number'],
+            object_key=fax['object_key'],
+            pages=fax['pages'],
+            digest=recipient
         )
-    # Display an error if something goes wrong.
-    except ClientError as e:
-        logger.error(e.response['Error']['Message'])
-    else:
-        logger.info(f"Email sent! Message ID: {response['MessageId']}")
+
+
+@metrics.handler('flush_fax_digests')
+def flush_digests_handler(event, context):
+    '''
+    Send the digest of every recipient, run on a schedule when DIGEST_MODE is digest.
+    '''
+    logger.info("Flushing fax digests.")
+    for recipient in digest_table.keys():
+        send_digest(recipient)
+
+
+def process_record(record):
+    # SQS can deliver a message more than once, recipients only get one email per fax
+    job = fax_job.FaxJob.from_json(record['body'])
+    return idempotency.run_once(f"fax_to_email#{job.bucket}/{job.object_key}", process_job, job)
+
+
+@metrics.handler('fax_to_email')
+def lambda_handler(event, context):
+    '''
+    Send every fax queued by FetchFaxFunction to the emails routed from its fax number.
+    '''
+    return records.process_records(event, process_record)
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+import requests
+
+import clients
+import fax_job
+import idempotency
+import metrics
+import queues
+import records
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Queue of FaxToEmailFunction
+fax_to_email_queue = queues.get_queue('FAX_TO_EMAIL_QUEUE_URL')
+
+# Pooled http session for fetching fax media from Twilio
+http_session = requests.Session()
+http_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+http_timeout = (
+    float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3)),
+    float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+)
+
+# Upload media in bounded parts so memory use doesn't grow with the number of pages
+transfer_config = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=2
+)
+
+
+def fetch_fax(fax):
+    '''
+    Stream a received fax from Twilio into S3 bucket RecieveFaxBucket.
+    The object is named after the fax sid, so fetching it again after a failure overwrites the same object.
+    '''
+    bucket_name = os.environ['BUCKET_NAME']
+    pdf_name = f"Fax_{fax['fax_sid']}.pdf"
+
+    job = fax_job.FaxJob(
+        bucket=bucket_name,
+        object_key=pdf_name,
+        from_number=fax['from_number'],
+        to_number=fax['to_number'],
+        pages=fax['pages'],
+        fax_sid=fax['fax_sid']
+    )
+
+    try:
+        logger.info(f"Creating pdf file name {pdf_name} from {fax['media_url']}")
+        # The body is read while it is uploaded, so media_download only covers the time to the response headers
+        with metrics.stage('media_download'):
+            response = http_session.get(fax['media_url'], stream=True, timeout=http_timeout)
+        with response, metrics.stage('s3_put'):
+            response.raise_for_status()
+            response.raw.decode_content = True
+            clients.client('s3').upload_fileobj(
+                response.raw,
+                bucket_name,
+                pdf_name,
+                ExtraArgs={
+                    'ACL': 'private',
+                    'ContentType': 'application/pdf',
+                    'Metadata': {
+                        'to_number': fax['to_number'],
+                        'from_number': fax['from_number'],
+                        'pages': fax['pages']
+                    }
+                },
+                Config=transfer_config
+            )
+        logger.info(f"Successfully saved pdf to {bucket_name} bucket.")
+
+        # Hand the fax to FaxToEmailFunction
+        fax_job.send_jobs(fax_to_email_queue, [job])
+
+        return True
+
+    except (ClientError, S3UploadFailedError, requests.RequestException) as e:
+        logger.error(f"Error occurred saving PDF to S3 bucket, media url is {fax['media_url']}")
+        logger.error(e)
+
+        raise
+
+
+def process_record(record):
+    # Twilio retries webhooks and SQS redelivers messages, every fax is only fetched and emailed once
+    fax = json.loads(record['body'])
+    return idempotency.run_once(f"fetch_fax#{fax['fax_sid']}", fetch_fax, fax)
+
+
+# --------------- Main handler ------------------
+@metrics.handler('fetch_fax')
+def lambda_handler(event, context):
+    '''
+    Fetch every fax queued by the /fax/receive endpoint.
+    Failed messages are retried by SQS and end up in ReceiveFaxDeadLetterQueue.
+    '''
+    return records.process_records(event, process_record)
@@ -0,0 +1,73 @@
+import logging
+import os
+import time
+
+import store
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Seconds a claim blocks other deliveries of the same work. At least the function timeout, so a claim outlives
+# the invocation that holds it, and less than the visibility timeout of the function's queue, so the redelivery
+# of work claimed by an invocation that crashed or timed out finds the claim expired
+lease_seconds = int(os.environ.get('IDEMPOTENCY_LEASE', 300))
+
+# Seconds finished work is remembered, longer than SQS keeps messages and SES redelivers events
+done_ttl = int(os.environ.get('IDEMPOTENCY_TTL', 4 * 24 * 60 * 60))
+
+# Keys of work in progress or done, each key is claimed with a conditional write
+idempotency_table = store.get_table('IDEMPOTENCY_TABLE')
+
+
+class InProgress(Exception):
+    '''
+    Raised for work another delivery has claimed but not finished, so this delivery is retried later.
+    '''
+
+
+def claim(key):
+    '''
+    Returns True if the caller may do the work of key, False if it's done or another delivery claimed it.
+    '''
+    return idempotency_table.put(
+        key,
+        {'status': 'in_progress', 'expires_at': int(time.time()) + lease_seconds},
+        if_not_exists=True
+    )
+
+
+def complete(key):
+    idempotency_table.put(key, {'status': 'done', 'expires_at': int(time.time()) + done_ttl})
+
+
+def release(key):
+    '''
+    Give up a claim after the work failed, so the next delivery can retry right away.
+    '''
+    idempotency_table.delete(key)
+
+
+def run_once(key, function, *args):
+    '''
+    Call function(*args) and return its result, or None if the work of key is done.
+    Redelivered messages and events then cost one conditional write instead of running again.
+    Raises InProgress if another delivery claimed the work and hasn't finished it, so the record fails
+    and is retried instead of being deleted before the work is done.
+    '''
+    if not claim(key):
+        item = idempotency_table.get(key)
+        if item is None or item.get('status') != 'done':
+            raise InProgress(f"{key} is being processed by another delivery")
+        logger.info(f"Skipping {key}, it was already processed")
+        return None
+
+    try:
+        result = function(*args)
+    except Exception:
+        release(key)
+        raise
+
+    complete(key)
+    return result
@@ -0,0 +1,100 @@
+from datetime import datetime, timezone
+import logging
+import os
+
+import store
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Directions of a fax, from the point of view of this account's fax numbers
+OUTBOUND = 'outbound'
+INBOUND = 'inbound'
+
+# Statuses of the events this app adds to Twilio's fax statuses
+SUBMITTED = 'submitted'
+CREATED = 'created'
+RECEIVED = 'received'
+EMAILED = 'emailed'
+
+# Days fax events are kept, independent of the lifecycle rules of the fax buckets
+retention_days = int(os.environ.get('LEDGER_RETENTION_DAYS', 400))
+
+# Secondary indexes of the ledger, of index name to partition and sort attribute.
+# line is this account's number, the sender of outbound and the receiver of inbound faxes
+indexes = {
+    'line': ('line', 'at'),
+    'direction': ('direction', 'at'),
+    'status': ('status', 'at'),
+    'day': ('day', 'at'),
+}
+
+# Every event of every fax, of fax id and status to the event
+ledger_table = store.get_table('LEDGER_TABLE', indexes)
+
+
+def record(fax_id, direction, status, line, remote, **details):
+    '''
+    Add an event to the ledger, details with a value are saved with it.
+    A fax only has one event per status, so a redelivered event replaces the first one.
+    The ledger is a record of faxes that were already sent or received, so failing to write it is only logged.
+    '''
+    now = datetime.now(timezone.utc)
+    # ISO 8601 timestamps with microseconds sort in time order as strings
+    at = now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    event = {
+        'fax_id': fax_id,
+        'direction': direction,
+        'status': status,
+        'line': line,
+        'remote': remote,
+        'at': at,
+        'day': at[:10],
+        'expires_at': int(now.timestamp()) + retention_days * 24 * 60 * 60
+    }
+    event.update({name: str(value) for name, value in details.items() if value not in (None, '')})
+
+    try:
+        ledger_table.put(f"{fax_id}#{status}", event)
+    except Exception as e:
+        logger.error(f"Unable to record {status} of fax {fax_id} in the ledger")
+        logger.error(e)
+
+
+def record_job(job, direction, status, **details):
+    '''
+    Add an event of a fax job to the ledger. Jobs are identified by their fax sid once Twilio created the fax,
+    and by their PDF and destination before.
+    '''
+    if direction == OUTBOUND:
+        line, remote = job.from_number, job.to_number
+    else:
+        line, remote = job.to_number, job.from_number
+    record(
+        job.fax_sid or f"{job.bucket}/{job.object_key}#{job.to_number}",
+        direction,
+        status,
+        line,
+        remote,
+        object_key=job.object_key,
+        filename=job.filename,
+        pages=job.pages,
+        attempt=job.attempt if direction == OUTBOUND else None,
+        **details
+    )
+
+
+def lookup(index, value, start=None, end=None, limit=100, cursor=None, newest_first=True, **filters):
+    '''
+    Return the events with a value of an index, between start and end when given, and equal to filters.
+    start and end are dates or timestamps, a date includes the whole day.
+    Every call reads at most limit events, returns (events, cursor to continue after them or None).
+    '''
+    if end is not None and len(end) == len('YYYY-MM-DD'):
+        # Timestamps of the end day sort after the day itself
+        end += 'T~'
+    return ledger_table.query(
+        index, value, start=start, end=end, limit=limit, cursor=cursor, descending=newest_first, filters=filters
+    )
@@ -0,0 +1,135 @@
+from contextlib import contextmanager
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# CloudWatch namespace of the metrics in the embedded metric format log lines
+namespace = os.environ.get('METRICS_NAMESPACE', 'AWSFax')
+
+# Fraction of invocations whose whole event is logged, the others only log a summary
+payload_sample_rate = float(os.environ.get('PAYLOAD_LOG_SAMPLE_RATE', 0.01))
+
+# Event fields left out of sampled events, the query string of API requests carries the api key
+redacted_fields = ('queryStringParameters', 'multiValueQueryStringParameters', 'rawQueryString')
+
+# EMF accepts at most 100 values of a metric in one log line
+max_values = 100
+
+# Stage durations in milliseconds of the current invocation, of (stage, outcome) to a list of durations
+timings = {}
+timings_lock = threading.Lock()
+
+
+def record(stage_name, outcome, duration):
+    with timings_lock:
+        timings.setdefault((stage_name, outcome), []).append(duration)
+
+
+@contextmanager
+def stage(stage_name):
+    '''
+    Time the block as one run of a stage, with outcome error if it raised.
+    Records are processed on several threads, so runs of a stage can overlap.
+    '''
+    start = time.perf_counter()
+    outcome = 'success'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        record(stage_name, outcome, (time.perf_counter() - start) * 1000)
+
+
+def emit(handler_name):
+    '''
+    Write the stage durations collected so far as EMF log lines and start collecting again.
+    Lambda sends stdout to CloudWatch Logs, which extracts the metrics without an agent or API calls.
+    '''
+    global timings
+
+    with timings_lock:
+        collected, timings = timings, {}
+
+    timestamp = int(time.time() * 1000)
+    for (stage_name, outcome), durations in collected.items():
+        for i in range(0, len(durations), max_values):
+            values = durations[i:i + max_values]
+            line = {
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [['Handler', 'Stage', 'Outcome'], ['Handler', 'Stage']],
+                        'Metrics': [
+                            {'Name': 'Duration', 'Unit': 'Milliseconds'},
+                            {'Name': 'Count', 'Unit': 'Count'}
+                        ]
+                    }]
+                },
+                'Handler': handler_name,
+                'Stage': stage_name,
+                'Outcome': outcome,
+                'Duration': [round(value, 3) for value in values],
+                'Count': len(values)
+            }
+            # EMF lines have to be bare json, without the prefix the logging handler adds
+            sys.stdout.write(json.dumps(line) + '\n')
+    sys.stdout.flush()
+
+
+def summarize(event):
+    if 'Records' in event:
+        sources = sorted({record.get('eventSource', '') for record in event['Records']})
+        return f"{len(event['Records'])} records from {', '.join(sources)}"
+    if 'httpMethod' in event or 'requestContext' in event:
+        http = event.get('requestContext', {}).get('http', {})
+        return f"{event.get('httpMethod', http.get('method'))} {event.get('path', event.get('rawPath'))}"
+    return f"event with keys {sorted(event)}"
+
+
+def log_event(event):
+    '''
+    Log the whole event for a sample of invocations, a one line summary otherwise.
+    '''
+    if random.random() < payload_sample_rate:
+        event = {name: value for name, value in event.items() if name not in redacted_fields}
+        logger.info(f"Received event {json.dumps(event, default=str)}")
+    else:
+        logger.info(f"Received {summarize(event)}")
+
+
+def handler(handler_name):
+    '''
+    Decorator for a lambda_handler, logs the event and emits the stage timings of every invocation.
+    The invocation itself is the stage "invocation", with outcome partial if some records failed.
+    '''
+    def decorate(lambda_handler):
+        @functools.wraps(lambda_handler)
+        def instrumented(event, context):
+            log_event(event)
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                response = lambda_handler(event, context)
+                failed = isinstance(response, dict) and response.get('batchItemFailures')
+                outcome = 'partial' if failed else 'success'
+                return response
+            finally:
+                record('invocation', outcome, (time.perf_counter() - start) * 1000)
+                emit(handler_name)
+
+        return instrumented
+
+    return decorate
@@ -0,0 +1,169 @@
+import binascii
+from email.parser import BytesFeedParser
+
+
+# Bytes of encoded body decoded at a time
+chunk_size = 64 * 1024
+
+
+def iter_lines(stream, read_size=64 * 1024):
+    '''
+    Yield the lines of a binary stream, including their line endings.
+    '''
+    pending = b''
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+
+def read_headers(lines):
+    '''
+    Parse header lines up to the first blank line into an email.message.Message without a payload.
+    '''
+    parser = BytesFeedParser()
+    for line in lines:
+        parser.feed(line)
+        if line in (b'\n', b'\r\n'):
+            break
+    return parser.close()
+
+
+class Base64Decoder:
+    def __init__(self):
+        self.pending = b''
+
+    def decode(self, data):
+        data = self.pending + b''.join(data.split())
+        usable = len(data) - len(data) % 4
+        self.pending = data[usable:]
+        return binascii.a2b_base64(data[:usable])
+
+    def flush(self):
+        return binascii.a2b_base64(self.pending) if self.pending else b''
+
+
+class LineDecoder:
+    '''
+    Decoder for 7bit, 8bit, binary and quoted-printable bodies.
+    The line break before a boundary belongs to the boundary, so the last one is held back.
+    '''
+
+    def __init__(self, quoted_printable=False):
+        self.quoted_printable = quoted_printable
+        self.pending = b''
+
+    def decode(self, data):
+        data = self.pending + data
+        end = len(data)
+        if data.endswith(b'\r\n'):
+            end -= 2
+        elif data.endswith(b'\n'):
+            end -= 1
+        if self.quoted_printable and data[:end].endswith(b'='):
+            # Keep a soft line break together with its line ending
+            end -= 1
+        self.pending = data[end:]
+        data = data[:end]
+        return binascii.a2b_qp(data) if self.quoted_printable else data
+
+    def flush(self):
+        return b''
+
+
+def get_decoder(headers):
+    encoding = headers.get('Content-Transfer-Encoding', '7bit').strip().lower()
+    if encoding == 'base64':
+        return Base64Decoder()
+    return LineDecoder(quoted_printable=encoding == 'quoted-printable')
+
+
+def is_boundary(line, boundaries):
+    if not line.startswith(b'--'):
+        return False
+    line = line.rstrip()
+    return any(line in (b'--' + boundary, b'--' + boundary + b'--') for boundary in boundaries)
+
+
+class MimeStream:
+    '''
+    Streaming reader for a MIME email.
+    Only the top level headers are parsed up front, parts are decoded line by line as the stream is read,
+    so memory use doesn't depend on the size of the attachments.
+    '''
+
+    def __init__(self, stream):
+        self.lines = iter_lines(stream)
+        self.headers = read_headers(self.lines)
+
+    def extract(self, content_type, open_sink, limit=None):
+        '''
+        Decode every part of content_type into a writer returned by open_sink(part_headers).
+        Writers need write, close and abort methods. Returns the closed writers.
+        '''
+        sinks = []
+        self.walk(self.headers, [], content_type, open_sink, sinks, limit)
+        return sinks
+
+    def walk(self, headers, boundaries, content_type, open_sink, sinks, limit):
+        '''
+        Read one part, returns the boundary line that ended it or None at the end of the stream.
+        '''
+        boundary = headers.get_boundary() if headers.get_content_maintype() == 'multipart' else None
+        if boundary:
+            boundary = boundary.encode('latin-1')
+            inner_boundaries = boundaries + [boundary]
+
+            # Skip the preamble, then read parts until the close delimiter
+            line = self.skip(inner_boundaries)
+            while line is not None and line.rstrip() == b'--' + boundary:
+                part_headers = read_headers(self.lines)
+                line = self.walk(part_headers, inner_boundaries, content_type, open_sink, sinks, limit)
+
+            # Skip the epilogue
+            if line is not None and line.rstrip() == b'--' + boundary + b'--':
+                line = self.skip(boundaries)
+            return line
+
+        if headers.get_content_type() == content_type and (limit is None or len(sinks) < limit):
+            return self.copy(headers, boundaries, open_sink, sinks)
+
+        return self.skip(boundaries)
+
+    def skip(self, boundaries):
+        for line in self.lines:
+            if is_boundary(line, boundaries):
+                return line
+        return None
+
+    def copy(self, headers, boundaries, open_sink, sinks):
+        sink = open_sink(headers)
+        decoder = get_decoder(headers)
+        end = None
+        chunk = []
+        size = 0
+        try:
+            for line in self.lines:
+                if is_boundary(line, boundaries):
+                    end = line
+                    break
+                chunk.append(line)
+                size += len(line)
+                if size >= chunk_size:
+                    sink.write(decoder.decode(b''.join(chunk)))
+                    chunk = []
+                    size = 0
+            sink.write(decoder.decode(b''.join(chunk)) + decoder.flush())
+            sink.close()
+        except Exception:
+            sink.abort()
+            raise
+
+        sinks.append(sink)
+        return end
@@ -0,0 +1,69 @@
+import json
+import logging
+
+from botocore.exceptions import ClientError
+
+import clients
+import config
+import metrics
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# SES templates created by template.yaml
+FAX_RECEIVED = 'fax-received'
+FAX_DIGEST = 'fax-digest'
+UNAPPROVED_SENDER = 'unapproved-sender'
+INVALID_NUMBER = 'invalid-number'
+NO_PDF = 'no-pdf'
+INVALID_PDF = 'invalid-pdf'
+FAX_FAILED = 'fax-failed'
+
+# send_bulk_templated_email accepts at most 50 destinations per call
+max_destinations = 50
+
+
+def get_recipients(to_number):
+    '''
+    Return the emails a fax received on to_number is sent to.
+    /prod/fax_routing maps fax numbers to lists of emails, numbers without a route go to
+    the destination_email of /prod/fax_to_email.
+    '''
+    routes = config.get('/prod/fax_routing', {})
+    recipients = routes.get(to_number)
+    if recipients:
+        return [recipients] if isinstance(recipients, str) else recipients
+    return [config.get('/prod/fax_to_email')['destination_email']]
+
+
+def send(template, recipients, template_data, sender):
+    '''
+    Send a templated email to every recipient with one SES call per 50 recipients.
+    Raises ClientError if the call fails, failed destinations are only logged.
+    '''
+    logger.info(f"Attempting to send {template} email to {recipients}")
+    default_data = json.dumps(template_data)
+    for i in range(0, len(recipients), max_destinations):
+        try:
+            with metrics.stage('ses_send'):
+                response = clients.client('ses').send_bulk_templated_email(
+                    Source=sender,
+                    Template=template,
+                    DefaultTemplateData=default_data,
+                    Destinations=[
+                        {'Destination': {'ToAddresses': [recipient]}}
+                        for recipient in recipients[i:i + max_destinations]
+                    ],
+                )
+        except ClientError as e:
+            logger.error(f"Email failed to send")
+            logger.error(e.response['Error']['Message'])
+            raise
+
+        for recipient, status in zip(recipients[i:i + max_destinations], response['Status']):
+            if status['Status'] == 'Success':
+                logger.info(f"Email sent to {recipient}! Message ID: {status['MessageId']}")
+            else:
+                logger.error(f"Email to {recipient} failed to send: {status['Status']} {status.get('Error', '')}")
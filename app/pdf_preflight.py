@@ -0,0 +1,102 @@
+import logging
+import os
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Twilio rasterizes faxes at 204 dpi in black and white, images with more detail than that are only sent to be dropped
+fax_dpi = int(os.environ.get('FAX_DPI', 204))
+
+
+class PreflightError(Exception):
+    '''
+    Raised for a PDF that can't be faxed.
+    '''
+
+
+def open_pdf(source):
+    '''
+    Read the page tree of a PDF, returns (PdfReader, page count).
+    '''
+    # pypdf is only needed once an email has a pdf attachment
+    from pypdf import PdfReader
+
+    try:
+        reader = PdfReader(source)
+        if reader.is_encrypted and not reader.decrypt(''):
+            raise PreflightError("PDF is password protected")
+        pages = len(reader.pages)
+    except PreflightError:
+        raise
+    except Exception as e:
+        # pypdf raises many different errors for damaged files
+        raise PreflightError(f"PDF can't be read: {e}") from e
+
+    if not pages:
+        raise PreflightError("PDF has no pages")
+    return reader, pages
+
+
+def check(source):
+    '''
+    Return the page count of a PDF, raises PreflightError if it can't be read.
+    '''
+    pages = open_pdf(source)[1]
+    source.seek(0)
+    return pages
+
+
+def flatten(picture):
+    '''
+    Convert an image to 1-bit black and white, with transparent areas white like the paper.
+    '''
+    from PIL import Image
+
+    if picture.mode in ('RGBA', 'LA', 'PA') or 'transparency' in picture.info:
+        background = Image.new('RGBA', picture.size, 'white')
+        picture = Image.alpha_composite(background, picture.convert('RGBA'))
+    # Dithering keeps the shades of photos and scans readable in black and white
+    return picture.convert('L').convert('1')
+
+
+def shrink_images(page):
+    '''
+    Downsample the images of a page to at most fax_dpi at the size of the page, in black and white.
+    '''
+    # Pages and images can be rotated, so the longer side of the page limits both sides of an image
+    longest = int(max(float(page.mediabox.width), float(page.mediabox.height)) / 72 * fax_dpi)
+
+    for image in page.images:
+        try:
+            picture = image.image
+            if picture.mode == '1' and max(picture.size) <= longest:
+                continue
+            picture = picture.copy()
+            picture.thumbnail((longest, longest))
+            image.replace(flatten(picture))
+        except Exception as e:
+            # Unsupported image encodings are sent as they are
+            logger.info(f"Keeping image {image.name} unchanged: {e}")
+
+
+def optimize(source, target):
+    '''
+    Write a copy of a PDF to target with its images reduced to what a fax can show, returns the page count.
+    Raises PreflightError if the PDF can't be read.
+    '''
+    from pypdf import PdfWriter
+
+    reader, pages = open_pdf(source)
+    try:
+        writer = PdfWriter(clone_from=reader)
+        for page in writer.pages:
+            shrink_images(page)
+            page.compress_content_streams()
+        writer.write(target)
+    except Exception as e:
+        raise PreflightError(f"PDF can't be read: {e}") from e
+
+    logger.info(f"Optimized {pages} page PDF from {source.tell()} to {target.tell()} bytes")
+    return pages
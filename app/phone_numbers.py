@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import logging
+import os
+import re
+import threading
+import time
+
+import metrics
+import store
+import twilio_client
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# E.164: a plus sign followed by up to 15 digits, the first of which isn't 0
+e164_pattern = re.compile(r'^\+[1-9]\d{1,14}$')
+formatting_pattern = re.compile(r'[\s\-().]')
+
+# Seconds a lookup result is trusted and number of results kept in memory
+lookup_ttl = int(os.environ.get('NUMBER_LOOKUP_TTL', 7 * 24 * 3600))
+lookup_cache_size = int(os.environ.get('NUMBER_LOOKUP_CACHE_SIZE', 1024))
+
+# Lookup results shared by every container, or kept per container if NUMBER_TABLE isn't set
+lookup_table = store.get_table('NUMBER_TABLE')
+
+# Least recently used lookup results of number to (valid, expiry time)
+lookup_cache = OrderedDict()
+lookup_cache_lock = threading.Lock()
+
+
+def normalize_number(number):
+    '''
+    Remove spaces, dashes, dots and parentheses from a phone number.
+    '''
+    return formatting_pattern.sub('', number or '')
+
+
+def is_e164(number):
+    return e164_pattern.match(number) is not None
+
+
+def cache_result(number, valid, expires_at):
+    with lookup_cache_lock:
+        lookup_cache[number] = (valid, expires_at)
+        lookup_cache.move_to_end(number)
+        while len(lookup_cache) > lookup_cache_size:
+            lookup_cache.popitem(last=False)
+
+
+def cached_result(number):
+    now = time.time()
+    with lookup_cache_lock:
+        cached = lookup_cache.get(number)
+        if cached is not None and cached[1] > now:
+            lookup_cache.move_to_end(number)
+            return cached[0]
+
+    item = lookup_table.get(number)
+    if item is not None:
+        cache_result(number, item['valid'], int(item['expires_at']))
+        return item['valid']
+
+    return None
+
+
+def check_number(number):
+    '''
+    Check if a number in E.164 format can receive a fax.
+    Malformed numbers are rejected without a network call, Twilio lookups are cached for lookup_ttl seconds.
+    Raises TwilioRestException if Twilio couldn't look up the number.
+    '''
+    if not is_e164(number):
+        logger.info(f"Number {number} isn't in E.164 format")
+        return False
+
+    valid = cached_result(number)
+    if valid is not None:
+        return valid
+
+    from twilio.base.exceptions import TwilioRestException
+
+    try:
+        with metrics.stage('twilio_lookup'):
+            twilio_client.get().lookups.phone_numbers(number).fetch()
+        valid = True
+    except TwilioRestException as e:
+        if e.status != 404:
+            # Rate limits and Twilio errors don't say anything about the number, fail so the email is retried
+            logger.error(f"Unable to look up number {number}")
+            logger.error(e)
+            raise
+        valid = False
+
+    expires_at = int(time.time()) + lookup_ttl
+    cache_result(number, valid, expires_at)
+    lookup_table.put(number, {'valid': valid, 'expires_at': expires_at})
+
+    return valid
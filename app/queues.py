@@ -0,0 +1,84 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+import clients
+import metrics
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# send_message_batch accepts at most 10 messages per call
+max_batch_size = 10
+
+# SQS delays a message by at most 15 minutes
+max_delay_seconds = 900
+
+
+class MemoryQueue:
+    '''
+    In-memory stand-in for SQSQueue, used when no queue is configured.
+    Messages only live as long as the container, receive returns them once their delay has passed.
+    '''
+
+    def __init__(self):
+        self.messages = []
+        self.order = itertools.count()
+        self.lock = threading.Lock()
+
+    def send(self, bodies, delay_seconds=0):
+        visible_at = time.monotonic() + delay_seconds
+        with self.lock:
+            for body in bodies:
+                heapq.heappush(self.messages, (visible_at, next(self.order), body))
+
+    def receive(self, max_messages=max_batch_size):
+        now = time.monotonic()
+        bodies = []
+        with self.lock:
+            while self.messages and self.messages[0][0] <= now and len(bodies) < max_messages:
+                bodies.append(heapq.heappop(self.messages)[2])
+        return bodies
+
+
+class SQSQueue:
+    '''
+    SQS queue, its messages are delivered to the function the queue triggers.
+    '''
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+
+    def send(self, bodies, delay_seconds=0):
+        '''
+        Send messages in batches, raises if any of them couldn't be sent.
+        '''
+        delay_seconds = min(int(delay_seconds), max_delay_seconds)
+        for i in range(0, len(bodies), max_batch_size):
+            with metrics.stage('sqs_send'):
+                response = clients.client('sqs').send_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[
+                        {'Id': str(n), 'MessageBody': body, 'DelaySeconds': delay_seconds}
+                        for n, body in enumerate(bodies[i:i + max_batch_size])
+                    ]
+                )
+            if response.get('Failed'):
+                logger.error(f"Failed to send messages {response['Failed']}")
+                raise RuntimeError(f"Failed to send {len(response['Failed'])} messages to {self.queue_url}")
+            logger.info(f"Sent {len(response['Successful'])} messages to {self.queue_url}")
+
+
+def get_queue(env_var):
+    '''
+    Return the SQS queue whose url is in an environment variable, or a MemoryQueue if it isn't set.
+    '''
+    queue_url = os.environ.get(env_var)
+    if queue_url:
+        return SQSQueue(queue_url)
+    return MemoryQueue()
@@ -1,107 +1,181 @@
-from datetime import datetime
+import base64
+import json
 import logging
 import os
 from urllib.parse import parse_qs
 
-import boto3
 from botocore.exceptions import ClientError
-import requests
+
+import clients
+import fax_history
+import ledger
+import metrics
+import retries
 
 
 # Initialize logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-ssm_client = boto3.client('ssm')
+# Final fax status values listed on Twilio's site:
+# https://www.twilio.com/docs/fax/api/faxes#fax-status-values
+terminal_statuses = ["delivered", "no-answer", "busy", "failed", "canceled"]
+
+# Responses that are the same for every request are built once per container
+# Tells Twilio where to send a fax, relative to the url of /fax/check
+check_response = {
+    "statusCode": 200,
+    "headers": {"Content-Type": 'text/xml'},
+    "body": '<Response><Receive action="/Prod/fax/receive"/></Response>'
+}
+
+# Empty body back to Twilio
+ok_response = {
+    "statusCode": 200,
+    "headers": {"Content-Type": 'application/json'},
+    "body": ""
+}
+
+# Lets Twilio retry the webhook
+retry_response = {
+    "statusCode": 500,
+    "headers": {"Content-Type": 'application/json'},
+    "body": ""
+}
 
 # Create generic 403 response
 return_403 = {
     "statusCode": 403,
     "headers": {"Content-Type": 'application/json'},
-    "body": {"message": "Missing Authentication Token"}
+    "body": json.dumps({"message": "Missing Authentication Token"})
 }
 
 
-def lambda_handler(event, context):
-    logger.info("Received event.")
-    logger.info(event)
-
-    method = event['httpMethod']
-    path = event['path']
-
-    # handle posts to /fax/check endpoint, starting point for Twilio communication
-    # returns endpoint where Twilio should send the fax
-    if method == 'POST' and path == '/fax/check':
-        twiml = """
-            <Response>
-                <Receive action="/Prod/fax/receive"/>
-            </Response>
-        """
-
-        logger.info("Executed /fax/check endpoint, returned twiml code")
-
-        return {
-            "statusCode": 200,
-            "headers": {"Content-Type": 'text/xml'},
-            "body": twiml
-        }
-
-    # handle posts to /fax/receive endpoint
-    # fetch pdf from twilio s3 bucket and save in s3 bucket in this account
-    # return empty body back to Twilio
-    if method == 'POST' and path == '/fax/receive':
-
-        # Parse media url
-        params_list = parse_qs(event['body'])
-        to_number = params_list['To'][0]
-        from_number = params_list['From'][0]
-        pages = params_list['NumPages'][0]
-        media_url = params_list['MediaUrl'][0]
-        logger.info(f"Received pdf location at: {media_url}")
-
-        # Get PDF from Twilio
-        response = requests.get(media_url)
-        pdf_object = response.content
-        logger.info("Successfully retrieved pdf.")
-        now = datetime.now().strftime("%Y-%d-%m_%H:%M:%S")
-        pdf_name = f"Fax_{now}.pdf"
-
-        # Save PDF in S3 Bucket
-        bucket_name = os.environ['BUCKET_NAME']
-        logger.info(f"Got bucket name {bucket_name}")
-        s3 = boto3.resource('s3')
-        bucket = s3.Bucket(bucket_name)
-        logger.info(f"Got bucket {bucket}")
-        try:
-            logger.info(f"Creating pdf file name {pdf_name}")
-            bucket.put_object(
-                ACL='private',
-                Body=pdf_object,
-                ContentType='application/pdf',
-                Key=pdf_name,
-                Metadata={
-                    'to_number': to_number,
-                    'from_number': from_number,
-                    'pages': pages
-                }
+def fax_check(event):
+    '''
+    Starting point for Twilio communication, returns endpoint where Twilio should send the fax.
+    '''
+    logger.info("Executed /fax/check endpoint, returned twiml code")
+    return check_response
+
+
+def fax_receive(event):
+    '''
+    Queue a received fax for FetchFaxFunction, which saves the pdf in s3 bucket in this account.
+    '''
+    params_list = parse_qs(event['body'])
+    fax = {
+        'fax_sid': params_list['FaxSid'][0],
+        'to_number': params_list['To'][0],
+        'from_number': params_list['From'][0],
+        'pages': params_list['NumPages'][0],
+        'media_url': params_list['MediaUrl'][0]
+    }
+    logger.info(f"Received pdf location at: {fax['media_url']}")
+
+    try:
+        with metrics.stage('sqs_send'):
+            clients.client('sqs').send_message(
+                QueueUrl=os.environ['QUEUE_URL'],
+                MessageBody=json.dumps(fax)
+            )
+        logger.info(f"Queued fax {fax['fax_sid']} for fetching.")
+
+    except ClientError as e:
+        logger.error(f"Error occurred queueing fax, media url is {fax['media_url']}")
+        logger.error(e)
+        return retry_response
+
+    ledger.record(
+        fax['fax_sid'],
+        ledger.INBOUND,
+        ledger.RECEIVED,
+        fax['to_number'],
+        fax['from_number'],
+        pages=fax['pages']
+    )
+    return ok_response
+
+
+def fax_status(event):
+    '''
+    Twilio calls this with every status change of a fax created by SendFaxFunction,
+    busy, no-answer and failed faxes are queued again until they run out of attempts.
+    '''
+    params_list = parse_qs(event['body'])
+    fax_sid = params_list['FaxSid'][0]
+    status = params_list['FaxStatus'][0]
+
+    ledger.record(
+        fax_sid,
+        ledger.OUTBOUND,
+        status,
+        params_list['From'][0],
+        params_list['To'][0],
+        pages=params_list.get('NumPages', [''])[0],
+        error_message=params_list.get('ErrorMessage', [''])[0]
+    )
+
+    try:
+        if status == "delivered":
+            logger.info(
+                "SUCCESS: Sending fax completed successfully. "
+                f"fax_id = {fax_sid}, "
+                f"fax_from = {params_list['From'][0]}, "
+                f"fax_to = {params_list['To'][0]}, "
+                f"fax_num_pages = {params_list.get('NumPages', [''])[0]}"
             )
-            logger.info(f"Successfully saved pdf to RecieveFaxBucket bucket.")
+            retries.record_delivered(fax_sid)
+        elif status in retries.retry_statuses:
+            error_message = params_list.get('ErrorMessage', [''])[0]
+            logger.error(f"FAILED: Sending fax {fax_sid} failed with status code: {status}. {error_message}")
+            retries.record_failure(fax_sid, status, error_message)
+        elif status in terminal_statuses:
+            logger.error(f"FAILED: Sending fax {fax_sid} ended with status code: {status}.")
+            retries.forget(fax_sid)
+        else:
+            logger.info(f"Fax {fax_sid} changed status to {status}")
+
+    except Exception as e:
+        logger.error(f"Error occurred handling status {status} of fax {fax_sid}")
+        logger.error(e)
+        return retry_response
+
+    return ok_response
+
+
+# Handler of every endpoint, of (method, path)
+routes = {
+    ('POST', '/fax/check'): fax_check,
+    ('POST', '/fax/receive'): fax_receive,
+    ('POST', '/fax/status'): fax_status,
+    ('GET', '/fax/history'): fax_history.handle,
+}
+
 
-            return {
-                "statusCode": 200,
-                "headers": {"Content-Type": 'application/json'},
-                "body": ""
-            }
+def route_key(event):
+    '''
+    Return the method and path of a REST API (payload format 1.0) or HTTP API (payload format 2.0) event.
+    '''
+    if 'httpMethod' in event:
+        return event['httpMethod'], event['path']
 
-        except ClientError as e:
-            logger.error(f"Error occurred saving PDF to S3 bucket, media url is {media_url}")
-            logger.error(e)
+    http = event['requestContext']['http']
+    path = http['path']
+    # Unlike REST APIs, HTTP APIs include the name of a stage other than $default in the path
+    stage = event['requestContext'].get('stage', '$default')
+    if stage != '$default' and path.startswith(f"/{stage}/"):
+        path = path[len(stage) + 1:]
+    return http['method'], path
 
-            return {
-                "statusCode": 200,
-                "headers": {"Content-Type": 'application/json'},
-                "body": ""
-            }
 
-    return return_403
+@metrics.handler('receive_fax')
+def lambda_handler(event, context):
+    handler = routes.get(route_key(event))
+    if handler is None:
+        return return_403
+
+    # HTTP APIs base64 encode form posts
+    if event.get('isBase64Encoded') and event.get('body'):
+        event = dict(event, body=base64.b64decode(event['body']).decode('utf-8'), isBase64Encoded=False)
+    return handler(event)
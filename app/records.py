@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+from urllib.parse import unquote_plus
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Number of records processed at the same time in one invocation
+record_workers = int(os.environ.get('RECORD_WORKERS', 1))
+
+
+def record_id(record):
+    '''
+    Return the identifier Lambda expects in a partial batch response.
+    '''
+    if record.get('eventSource') == 'aws:sqs':
+        return record['messageId']
+    return record['s3']['object']['key']
+
+
+def s3_objects(record):
+    '''
+    Return a list of (bucket name, object key) for a record.
+    An SQS record carries a whole S3 notification in its body, which can hold several objects.
+    '''
+    if record.get('eventSource') == 'aws:sqs':
+        body = json.loads(record['body'])
+        return [s3_object for s3_record in body.get('Records', []) for s3_object in s3_objects(s3_record)]
+
+    bucket_name = record['s3']['bucket']['name']
+    object_key = unquote_plus(record['s3']['object']['key'])
+    return [(bucket_name, object_key)]
+
+
+def process_records(event, handler, workers=None):
+    '''
+    Call handler for every record in the event, on up to workers threads.
+    Records whose handler raised are returned as a partial batch response for SQS events.
+    S3 invokes functions asynchronously and Lambda ignores their response, so a failed record
+    raises after every record was processed to have Lambda retry the event.
+    '''
+    workers = workers or record_workers
+    event_records = event.get('Records', [])
+
+    def process(record):
+        try:
+            handler(record)
+            return None
+        except Exception as e:
+            logger.error(f"Failed to process record {record_id(record)}")
+            logger.exception(e)
+            return {"itemIdentifier": record_id(record)}
+
+    if workers > 1 and len(event_records) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(event_records))) as executor:
+            results = list(executor.map(process, event_records))
+    else:
+        results = [process(record) for record in event_records]
+
+    failures = [result for result in results if result is not None]
+    logger.info(f"Processed {len(event_records)} records with {len(failures)} failures")
+
+    if failures and any(record.get('eventSource') != 'aws:sqs' for record in event_records):
+        raise RuntimeError(f"Failed to process {len(failures)} of {len(event_records)} records")
+
+    return {"batchItemFailures": failures}
+
+
+def process_s3_objects(event, handler, workers=None):
+    '''
+    Call handler(bucket_name, object_key) for every S3 object in an S3 or SQS event.
+    '''
+    def process(record):
+        for bucket_name, object_key in s3_objects(record):
+            handler(bucket_name, object_key)
+
+    return process_records(event, process, workers)
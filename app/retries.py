@@ -0,0 +1,125 @@
+from dataclasses import replace
+import logging
+import os
+import random
+import time
+
+import config
+import dispatch
+import fax_job
+import notify
+import queues
+import store
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Final fax statuses worth sending the fax again for
+retry_statuses = ["busy", "no-answer", "failed"]
+
+# Attempts to send a fax, including the first one, before its sender is notified
+max_attempts = int(os.environ.get('RETRY_MAX_ATTEMPTS', 3))
+
+# Seconds before the first retry, doubled for every failure of the destination up to max_delay
+base_delay = int(os.environ.get('RETRY_BASE_DELAY', 60))
+max_delay = min(int(os.environ.get('RETRY_MAX_DELAY', 900)), queues.max_delay_seconds)
+
+# Seconds a created fax waits for its final status, PDFs in SendFaxBucket expire after a day anyway
+sent_fax_ttl = 24 * 60 * 60
+
+# Jobs of created faxes by fax sid, and failures of every destination number
+retry_table = store.get_table('RETRY_TABLE')
+
+
+def fax_key(fax_sid):
+    return f"fax#{fax_sid}"
+
+
+def destination_key(number):
+    return f"destination#{number}"
+
+
+def track(fax_sid, job):
+    '''
+    Remember the job of a created fax until Twilio posts its final status.
+    '''
+    retry_table.put(fax_key(fax_sid), {'job': job.to_json(), 'expires_at': int(time.time()) + sent_fax_ttl})
+
+
+def forget(fax_sid):
+    '''
+    Stop waiting for the status of a fax, returns its job or None if it wasn't tracked.
+    Twilio can post a status more than once, only the first post gets the job.
+    '''
+    item = retry_table.pop(fax_key(fax_sid))
+    return fax_job.FaxJob.from_json(item['job']) if item is not None else None
+
+
+def backoff(failures):
+    '''
+    Exponential backoff with equal jitter, half of the delay is fixed and the other half random,
+    so faxes that failed together don't all retry at the same moment.
+    '''
+    delay = min(max_delay, base_delay * 2 ** (failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def record_delivered(fax_sid):
+    job = forget(fax_sid)
+    if job is not None:
+        retry_table.delete(destination_key(job.to_number))
+
+
+def record_failure(fax_sid, status, error_message=''):
+    '''
+    Queue the job of a failed fax again after a backoff, or notify its sender after the last attempt.
+    Returns True if the fax will be sent again.
+    '''
+    job = forget(fax_sid)
+    if job is None:
+        logger.info(f"Fax {fax_sid} isn't waiting for a status, ignoring {status}")
+        return False
+
+    try:
+        # Failures are counted per destination across faxes, so a number that is busy for everyone backs off further
+        destination = retry_table.get(destination_key(job.to_number)) or {'failures': 0}
+        failures = int(destination['failures']) + 1
+        retry_table.put(destination_key(job.to_number), {
+            'failures': failures,
+            'last_status': status,
+            'expires_at': int(time.time()) + sent_fax_ttl
+        })
+
+        if job.attempt >= max_attempts:
+            logger.error(f"Giving up on fax to {job.to_number} after {job.attempt} attempts, last status {status}")
+            notify_sender(job, status, error_message)
+            return False
+
+        delay = backoff(failures)
+        retry = replace(job, attempt=job.attempt + 1)
+        logger.info(f"Retrying fax to {job.to_number} in {delay:.0f} seconds, attempt {retry.attempt} of {max_attempts}")
+        fax_job.send_jobs(dispatch.lane(retry), [retry], delay_seconds=delay)
+        return True
+
+    except Exception:
+        # Keep waiting for the status, so the next post of it is handled
+        track(fax_sid, job)
+        raise
+
+
+def notify_sender(job, status, error_message):
+    recipients = [job.from_email] if job.from_email else [config.get('/prod/admin_email')]
+    notify.send(
+        notify.FAX_FAILED,
+        recipients,
+        {
+            'to_phone': job.to_number,
+            'filename': job.filename or job.object_key,
+            'status': status,
+            'attempts': job.attempt,
+            'error_message': error_message
+        },
+        config.get('/prod/aws_email')
+    )
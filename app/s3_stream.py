@@ -0,0 +1,134 @@
+from concurrent.futures import wait, FIRST_COMPLETED
+import logging
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# S3 requires every part except the last one to be at least 5 MB
+part_size = 8 * 1024 * 1024
+
+# Parts of one upload held in memory while waiting for the executor
+max_pending_parts = 2
+
+
+class S3MultipartWriter:
+    '''
+    File-like writer that uploads to S3 in parts of part_size bytes, so only one part is held in memory.
+    Objects smaller than one part are saved with a single put_object call.
+    With an executor, parts are uploaded and the upload is completed on its threads,
+    call result() to wait for the object to be saved.
+    '''
+
+    def __init__(self, s3_client, bucket_name, object_key, executor=None, **extra_args):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.executor = executor
+        self.extra_args = extra_args
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.pending = set()
+        self.future = None
+        self.size = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= part_size:
+            self.upload_part(bytes(self.buffer[:part_size]))
+            del self.buffer[:part_size]
+
+    def upload_part(self, body):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.object_key,
+                **self.extra_args
+            )
+            self.upload_id = response['UploadId']
+
+        part_number = len(self.parts) + 1
+        self.parts.append(None)
+        if self.executor is None:
+            self.send_part(part_number, body)
+            return
+
+        while len(self.pending) >= max_pending_parts:
+            done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        self.pending.add(self.executor.submit(self.send_part, part_number, body))
+
+    def send_part(self, part_number, body):
+        response = self.s3_client.upload_part(
+            Body=body,
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            PartNumber=part_number,
+            UploadId=self.upload_id
+        )
+        self.parts[part_number - 1] = {'ETag': response['ETag'], 'PartNumber': part_number}
+
+    def close(self):
+        '''
+        Upload the remaining bytes and complete the upload.
+        '''
+        if self.upload_id is not None and self.buffer:
+            self.upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+
+        if self.executor is None:
+            self.finish()
+        else:
+            self.future = self.executor.submit(self.finish)
+
+    def finish(self):
+        if self.upload_id is None:
+            self.s3_client.put_object(
+                Body=bytes(self.buffer),
+                Bucket=self.bucket_name,
+                Key=self.object_key,
+                **self.extra_args
+            )
+            self.buffer = bytearray()
+        else:
+            # Parts were submitted before this call, so they are ahead of it in the executor queue
+            for future in wait(self.pending).done:
+                future.result()
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.object_key,
+                MultipartUpload={'Parts': self.parts},
+                UploadId=self.upload_id
+            )
+        logger.info(f"Uploaded {self.size} bytes to {self.bucket_name}/{self.object_key}")
+
+    def result(self):
+        '''
+        Wait for an upload running on the executor, aborting it if it failed.
+        '''
+        if self.future is not None:
+            try:
+                self.future.result()
+            except Exception:
+                self.abort()
+                raise
+
+    def abort(self):
+        '''
+        Drop any uploaded parts so they aren't billed.
+        '''
+        self.buffer = bytearray()
+        if self.pending:
+            wait(self.pending)
+            self.pending = set()
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.object_key,
+                UploadId=self.upload_id
+            )
+            self.upload_id = None
@@ -0,0 +1,271 @@
+import bisect
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import clients
+
+
+class MemoryIndex:
+    '''
+    Sorted keys of the items with one partition value of a secondary index, found by binary search.
+    '''
+
+    def __init__(self):
+        # Sort values, and (sort value, key) pairs in the same order so items with equal sort values stay apart
+        self.values = []
+        self.entries = []
+
+    def add(self, value, key):
+        i = bisect.bisect_right(self.entries, (value, key))
+        self.entries.insert(i, (value, key))
+        self.values.insert(i, value)
+
+    def remove(self, value, key):
+        i = bisect.bisect_left(self.entries, (value, key))
+        if i < len(self.entries) and self.entries[i] == (value, key):
+            del self.entries[i]
+            del self.values[i]
+
+    def keys(self, start=None, end=None, after=None, descending=False):
+        '''
+        Yield the keys with sort values between start and end, both included, continuing past the entry after.
+        '''
+        low = 0 if start is None else bisect.bisect_left(self.values, start)
+        high = len(self.values) if end is None else bisect.bisect_right(self.values, end)
+        if after is not None:
+            if descending:
+                high = min(high, bisect.bisect_left(self.entries, after))
+            else:
+                low = max(low, bisect.bisect_right(self.entries, after))
+
+        positions = range(high - 1, low - 1, -1) if descending else range(low, high)
+        for i in positions:
+            yield self.entries[i][1]
+
+
+class MemoryTable:
+    '''
+    In-memory stand-in for DynamoDBTable, used when no table is configured.
+    Items only live as long as the container.
+    '''
+
+    def __init__(self, indexes=None):
+        self.items = {}
+        self.lock = threading.Lock()
+        self.indexes = indexes or {}
+        # Index name to partition value to MemoryIndex
+        self.index_keys = {name: {} for name in self.indexes}
+
+    def index(self, key, item, add=True):
+        for name, (partition, sort) in self.indexes.items():
+            # Like DynamoDB, items without the key attributes of an index aren't in it
+            if partition not in item or sort not in item:
+                continue
+            partitions = self.index_keys[name]
+            if add:
+                partitions.setdefault(item[partition], MemoryIndex()).add(item[sort], key)
+            elif item[partition] in partitions:
+                partitions[item[partition]].remove(item[sort], key)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None or expired(item):
+            return None
+        return dict(item)
+
+    def put(self, key, item, if_not_exists=False, version=None):
+        with self.lock:
+            current = self.get(key)
+            if (if_not_exists or version == 0) and current is not None:
+                return False
+            if version and (current is None or current.get('version') != version):
+                return False
+            self.index(key, self.items.get(key, {}), add=False)
+            self.items[key] = dict(item)
+            self.index(key, item)
+            return True
+
+    def delete(self, key):
+        self.pop(key)
+
+    def append(self, key, attribute, value):
+        with self.lock:
+            values = self.items.setdefault(key, {}).setdefault(attribute, [])
+            values.append(value)
+            return len(values)
+
+    def pop(self, key):
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is not None:
+                self.index(key, item, add=False)
+            return item
+
+    def keys(self):
+        return list(self.items)
+
+    def query(self, index, value, start=None, end=None, limit=100, cursor=None, descending=False, filters=None):
+        partition, sort = self.indexes[index]
+        partition_index = self.index_keys[index].get(value)
+        if partition_index is None:
+            return [], None
+
+        after = (cursor[sort], cursor['pk']) if cursor else None
+        items = []
+        examined = 0
+        last = None
+        with self.lock:
+            for key in partition_index.keys(start, end, after, descending):
+                # Like DynamoDB, limit counts the items read before filtering and a cursor continues after them
+                if examined == limit:
+                    return items, {'pk': last, partition: value, sort: self.items[last][sort]}
+                examined += 1
+                last = key
+                item = self.items[key]
+                if not expired(item) and matches(item, filters):
+                    items.append(dict(item))
+        return items, None
+
+
+class DynamoDBTable:
+    '''
+    DynamoDB table with a string partition key named pk and a ttl attribute named expires_at.
+    indexes maps the name of every global secondary index to its partition and sort key attributes.
+    '''
+
+    def __init__(self, table_name, indexes=None):
+        self.table_name = table_name
+        self.indexes = indexes or {}
+
+    @property
+    def table(self):
+        return clients.resource('dynamodb').Table(self.table_name)
+
+    def get(self, key):
+        item = self.table.get_item(Key={'pk': key}).get('Item')
+        if item is None or expired(item):
+            return None
+        item.pop('pk')
+        return item
+
+    def put(self, key, item, if_not_exists=False, version=None):
+        '''
+        Save an item, with if_not_exists only when there is no unexpired item with the same key,
+        with version only when the saved item has that version attribute, or doesn't exist for version 0.
+        Returns False if the item wasn't saved.
+        '''
+        kwargs = {}
+        if version:
+            kwargs['ConditionExpression'] = 'version = :version'
+            kwargs['ExpressionAttributeValues'] = {':version': version}
+        elif if_not_exists or version == 0:
+            kwargs['ConditionExpression'] = 'attribute_not_exists(pk) OR expires_at < :now'
+            kwargs['ExpressionAttributeValues'] = {':now': int(time.time())}
+        try:
+            self.table.put_item(Item=dict(item, pk=key), **kwargs)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def delete(self, key):
+        self.table.delete_item(Key={'pk': key})
+
+    def append(self, key, attribute, value):
+        '''
+        Append a value to a list attribute, creating the item if needed. Returns the length of the list.
+        '''
+        response = self.table.update_item(
+            Key={'pk': key},
+            UpdateExpression='SET #values = list_append(if_not_exists(#values, :empty), :value)',
+            ExpressionAttributeNames={'#values': attribute},
+            ExpressionAttributeValues={':empty': [], ':value': [value]},
+            ReturnValues='UPDATED_NEW'
+        )
+        return len(response['Attributes'][attribute])
+
+    def pop(self, key):
+        '''
+        Delete an item and return it, so only one caller gets it.
+        '''
+        item = self.table.delete_item(Key={'pk': key}, ReturnValues='ALL_OLD').get('Attributes')
+        if item is not None:
+            item.pop('pk')
+        return item
+
+    def keys(self):
+        paginator = self.table.meta.client.get_paginator('scan')
+        pages = paginator.paginate(TableName=self.table.name, ProjectionExpression='pk')
+        return [item['pk']['S'] for page in pages for item in page['Items']]
+
+    def query(self, index, value, start=None, end=None, limit=100, cursor=None, descending=False, filters=None):
+        '''
+        Read up to limit items from the partition value of a secondary index in order of its sort key,
+        with sort keys between start and end when given, leaving out items that don't equal filters.
+        Returns the items and a cursor to pass to the next query, or None after the last item.
+        '''
+        partition, sort = self.indexes[index]
+        names = {'#partition': partition}
+        values = {':value': value}
+        condition = '#partition = :value'
+        if start is not None or end is not None:
+            names['#sort'] = sort
+        if start is not None:
+            values[':start'] = start
+        if end is not None:
+            values[':end'] = end
+        if start is not None and end is not None:
+            condition += ' AND #sort BETWEEN :start AND :end'
+        elif start is not None:
+            condition += ' AND #sort >= :start'
+        elif end is not None:
+            condition += ' AND #sort <= :end'
+
+        kwargs = {}
+        if filters:
+            for n, (name, filter_value) in enumerate(filters.items()):
+                names[f'#filter{n}'] = name
+                values[f':filter{n}'] = filter_value
+            kwargs['FilterExpression'] = ' AND '.join(f'#filter{n} = :filter{n}' for n in range(len(filters)))
+        if cursor:
+            kwargs['ExclusiveStartKey'] = cursor
+
+        response = self.table.query(
+            IndexName=index,
+            KeyConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ScanIndexForward=not descending,
+            Limit=limit,
+            **kwargs
+        )
+        items = [item for item in response['Items'] if not expired(item)]
+        for item in items:
+            item.pop('pk')
+        return items, response.get('LastEvaluatedKey')
+
+
+def expired(item):
+    '''
+    DynamoDB deletes expired items up to a few days late, so expiry is also checked on read.
+    Compared in whole seconds like the condition of put, so an item get doesn't return can always be replaced.
+    '''
+    return 'expires_at' in item and int(item['expires_at']) < int(time.time())
+
+
+def matches(item, filters):
+    return all(item.get(name) == value for name, value in (filters or {}).items())
+
+
+def get_table(env_var, indexes=None):
+    '''
+    Return the DynamoDB table named by an environment variable, or a MemoryTable if it isn't set.
+    '''
+    table_name = os.environ.get(env_var)
+    if table_name:
+        return DynamoDBTable(table_name, indexes)
+    return MemoryTable(indexes)
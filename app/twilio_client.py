@@ -0,0 +1,51 @@
+import logging
+import os
+
+import config
+
+
+# Initialize logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The Twilio http client logs request payloads at INFO, the status callback url of a fax carries the api key
+logging.getLogger('twilio.http_client').setLevel(logging.WARNING)
+
+# Seconds to wait for api.twilio.com to connect and respond, a stuck request fails the record
+# so SQS retries it instead of the function timing out
+http_timeout = float(os.environ.get('TWILIO_TIMEOUT', 10))
+
+# Keep-alive connections to Twilio, at least one for every record processed at the same time
+pool_size = max(int(os.environ.get('TWILIO_POOL_SIZE', 4)), int(os.environ.get('RECORD_WORKERS', 4)))
+
+# Retries of requests that couldn't connect, requests that reached Twilio aren't retried
+# since creating a fax twice sends it twice
+connect_retries = int(os.environ.get('TWILIO_CONNECT_RETRIES', 2))
+
+
+def build_client(twilio_params):
+    '''
+    Create a Twilio client over a pooled keep-alive session.
+    '''
+    # twilio.rest is slow to import and only needed once a fax is sent or a number isn't cached
+    from requests.adapters import HTTPAdapter
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client
+    from urllib3.util.retry import Retry
+
+    http_client = TwilioHttpClient(pool_connections=True, timeout=http_timeout)
+    http_client.session.mount('https://', HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=connect_retries, connect=connect_retries, read=0, status=0, backoff_factor=0.2)
+    ))
+    logger.info("Created Twilio client")
+    return Client(twilio_params['twilio_account_id'], twilio_params['twilio_api_key'], http_client=http_client)
+
+
+def get():
+    '''
+    Return the Twilio client of this container, created again only when the Twilio parameters change.
+    The client is shared by the threads processing records, each request takes a connection from the pool.
+    '''
+    return config.get_derived('/prod/twilio', build_client)
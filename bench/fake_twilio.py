@@ -0,0 +1,150 @@
+'''
+Local stand-in for the Twilio REST API and media host, used by the benchmark.
+'''
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import itertools
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import fixtures
+
+# Status changes a fax goes through, posted to its status callback by the benchmark
+fax_transitions = ['queued', 'processing', 'sending', 'delivered']
+
+# Numbers ending with this are reported as not found by the lookup API
+invalid_suffix = '0000'
+
+
+class FakeTwilio:
+    '''
+    Serves:
+      GET  /media/<bytes>.pdf                           generated PDF of that size
+      GET  /lookups.twilio.com/v1/PhoneNumbers/<number>  lookup, 404 for numbers ending in 0000
+      POST /fax.twilio.com/v1/Faxes                      create a fax
+      GET  /fax.twilio.com/v1/Faxes/<sid>                fetch a fax, advancing its status
+    and counts the requests made to each endpoint.
+    '''
+
+    def __init__(self):
+        self.requests = Counter()
+        self.faxes = {}
+        self.pdfs = {}
+        self.sids = itertools.count()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def media_url(self, size):
+        return f"{self.url}/media/{size}.pdf"
+
+    def pdf(self, size):
+        with self.lock:
+            if size not in self.pdfs:
+                self.pdfs[size] = fixtures.make_pdf(size)
+            return self.pdfs[size]
+
+    def create_fax(self, params):
+        with self.lock:
+            sid = f"FX{next(self.sids):032d}"
+            self.faxes[sid] = dict(params, sid=sid, transition=0)
+        return self.fax_json(sid)
+
+    def fetch_fax(self, sid):
+        with self.lock:
+            fax = self.faxes[sid]
+            fax['transition'] = min(fax['transition'] + 1, len(fax_transitions) - 1)
+        return self.fax_json(sid)
+
+    def fax_json(self, sid):
+        fax = self.faxes[sid]
+        return {
+            'sid': sid,
+            'account_sid': 'AC' + '0' * 32,
+            'from': fax.get('From'),
+            'to': fax.get('To'),
+            'media_url': fax.get('MediaUrl'),
+            'quality': fax.get('Quality'),
+            'status': fax_transitions[fax['transition']],
+            'num_pages': 1,
+            'url': f"https://fax.twilio.com/v1/Faxes/{sid}"
+        }
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                parts = path.strip('/').split('/')
+                if parts[0] == 'media':
+                    fake.requests['media'] += 1
+                    pdf = fake.pdf(int(parts[1].split('.')[0]))
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/pdf')
+                    self.send_header('Content-Length', str(len(pdf)))
+                    self.end_headers()
+                    view = memoryview(pdf)
+                    for i in range(0, len(pdf), 1024 * 1024):
+                        self.wfile.write(view[i:i + 1024 * 1024])
+                elif parts[0] == 'lookups.twilio.com':
+                    fake.requests['lookup'] += 1
+                    number = parts[-1]
+                    if number.endswith(invalid_suffix):
+                        self.send_json(404, {'code': 20404, 'message': 'Not found', 'status': 404})
+                    else:
+                        self.send_json(200, {'phone_number': number, 'country_code': 'US'})
+                elif parts[0] == 'fax.twilio.com':
+                    fake.requests['fax_fetch'] += 1
+                    self.send_json(200, fake.fetch_fax(parts[-1]))
+                else:
+                    self.send_json(404, {'message': 'Not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                params = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+                if self.path.startswith('/fax.twilio.com/v1/Faxes'):
+                    fake.requests['fax_create'] += 1
+                    self.send_json(201, fake.create_fax(params))
+                else:
+                    self.send_json(404, {'message': 'Not found'})
+
+        return Handler
+
+
+def route_twilio_to(base_url):
+    '''
+    Send every request the twilio library makes to base_url instead of *.twilio.com.
+    '''
+    from twilio.http.http_client import TwilioHttpClient
+
+    request = TwilioHttpClient.request
+
+    def local_request(self, method, url, *args, **kwargs):
+        parts = urlsplit(url)
+        return request(self, method, f"{base_url}/{parts.netloc}{parts.path}", *args, **kwargs)
+
+    TwilioHttpClient.request = local_request
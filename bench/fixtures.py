@@ -0,0 +1,115 @@
+'''
+Generated inputs for the benchmark: PDFs, SES emails and Twilio webhooks.
+'''
+from email.message import EmailMessage
+from email.utils import format_datetime
+from datetime import datetime, timezone
+import os
+from urllib.parse import urlencode
+
+
+def make_pdf(size, pages=1):
+    '''
+    Return a valid PDF of about size bytes, padded with an incompressible image stream.
+    '''
+    padding = os.urandom(max(size - 1024, 0))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (5 + i) for i in range(pages))
+        + b"] /Count %d >>" % pages,
+        b"<< /Type /XObject /Subtype /Image /Width 1 /Height 1 /ColorSpace /DeviceGray /BitsPerComponent 8"
+        + b" /Length %d >>\nstream\n" % len(padding) + padding + b"\nendstream",
+        b"<< /Length 0 >>\nstream\n\nendstream",
+    ]
+    for _ in range(pages):
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R"
+            b" /Resources << /XObject << /Im0 3 0 R >> >> >>"
+        )
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+def make_email(from_email, to_phone, pdf_sizes, to_email='fax@example.com'):
+    '''
+    Return an SES email, as saved in EmailToFaxBucket, with a text body and one PDF attachment per size.
+    '''
+    msg = EmailMessage()
+    msg['From'] = from_email
+    msg['To'] = to_email
+    msg['Subject'] = to_phone
+    msg['Date'] = format_datetime(datetime.now(timezone.utc))
+    msg.set_content("Please fax the attached document.")
+    for index, size in enumerate(pdf_sizes):
+        msg.add_attachment(make_pdf(size), maintype='application', subtype='pdf', filename=f"document{index}.pdf")
+    return msg.as_bytes().replace(b'\n', b'\r\n')
+
+
+def s3_event(bucket_name, object_keys):
+    return {
+        'Records': [
+            {
+                'eventSource': 'aws:s3',
+                's3': {'bucket': {'name': bucket_name}, 'object': {'key': object_key}}
+            }
+            for object_key in object_keys
+        ]
+    }
+
+
+def sqs_event(bodies):
+    return {
+        'Records': [
+            {'eventSource': 'aws:sqs', 'messageId': f"message-{index}", 'body': body}
+            for index, body in enumerate(bodies)
+        ]
+    }
+
+
+def api_event(path, params=None, method='POST'):
+    return {
+        'httpMethod': method,
+        'path': path,
+        'headers': {'Content-Type': 'application/x-www-form-urlencoded'},
+        'body': urlencode(params or {})
+    }
+
+
+def receive_webhook(fax_sid, media_url, pages=1, to_number='+15555550100', from_number='+15555550199'):
+    return api_event('/fax/receive', {
+        'FaxSid': fax_sid,
+        'To': to_number,
+        'From': from_number,
+        'NumPages': pages,
+        'MediaUrl': media_url
+    })
+
+
+def status_webhook(fax_sid, status, to_number='+15555550199', from_number='+15555550100'):
+    return api_event('/fax/status', {
+        'FaxSid': fax_sid,
+        'FaxStatus': status,
+        'To': to_number,
+        'From': from_number,
+        'NumPages': 1
+    })
+
+
+def history_event(params):
+    return {
+        'httpMethod': 'GET',
+        'path': '/fax/history',
+        'headers': {},
+        'queryStringParameters': params,
+        'body': None
+    }
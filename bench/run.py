@@ -0,0 +1,424 @@
+'''
+Offline end-to-end benchmark of the Lambda handlers in app/.
+
+Every handler runs against moto's AWS stand-ins and a local fake of the Twilio API (fake_twilio.py),
+with generated SES emails, PDFs and Twilio webhooks (fixtures.py). Each scenario runs in its own
+process and reports latency percentiles, calls per external service per invocation and memory use.
+
+Usage: python bench/run.py [--scenarios email_to_fax send_fax ...] [--iterations 20] [--pdf-mb 1,10,50]
+                           [--json results.json]
+'''
+import argparse
+from collections import Counter
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(os.path.dirname(bench_dir), 'app')
+
+region = 'us-west-2'
+email_bucket = 'email-to-fax-bench'
+send_bucket = 'send-fax-bench'
+receive_bucket = 'receive-fax-bench'
+fax_number = '+15555550100'
+destination_number = '+15555550199'
+sender_email = 'sender@example.com'
+admin_email = 'admin@example.com'
+aws_email = 'fax@example.com'
+api_key_value = 'bench-api-key-value-0123456789'
+
+# SES templates used by notify.py, the content doesn't affect the benchmark
+template_names = ['fax-received', 'fax-digest', 'unapproved-sender', 'invalid-number', 'no-pdf', 'fax-failed', 'invalid-pdf']
+
+
+class Environment:
+    '''
+    AWS stand-ins, fake Twilio and call counters for one scenario process.
+    '''
+
+    def __init__(self):
+        os.environ.update({
+            'AWS_ACCESS_KEY_ID': 'testing',
+            'AWS_SECRET_ACCESS_KEY': 'testing',
+            'AWS_SESSION_TOKEN': 'testing',
+            'AWS_REGION': region,
+            'AWS_DEFAULT_REGION': region,
+        })
+        sys.path[:0] = [app_dir, bench_dir]
+
+        import boto3
+        from moto import mock_aws
+
+        import clients
+        import fake_twilio
+
+        self.mock = mock_aws()
+        self.mock.start()
+        self.twilio = fake_twilio.FakeTwilio().__enter__()
+        fake_twilio.route_twilio_to(self.twilio.url)
+
+        boto3.setup_default_session(region_name=region)
+        self.aws_calls = Counter()
+        self.counting = False
+        # The handlers create their clients from the session of clients.py
+        clients.session().events.register('before-call', self.count_call)
+        clients.session().events.register('after-call.ses.SendBulkTemplatedEmail', self.add_send_status)
+
+        self.create_resources(boto3)
+
+    def count_call(self, model, **kwargs):
+        if self.counting:
+            self.aws_calls[f"{model.service_model.service_name}.{model.name}"] += 1
+
+    def add_send_status(self, parsed, **kwargs):
+        # moto leaves Status out of the per destination results of a successful send
+        for status in parsed.get('Status', []):
+            status.setdefault('Status', 'Success')
+
+    def reset_counters(self):
+        self.aws_calls.clear()
+        self.twilio.requests.clear()
+
+    def create_resources(self, boto3):
+        s3 = boto3.client('s3')
+        for bucket in (email_bucket, send_bucket, receive_bucket):
+            s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': region})
+
+        sqs = boto3.client('sqs')
+        self.queues = {
+            name: sqs.create_queue(QueueName=name)['QueueUrl']
+            for name in ('send-fax', 'send-fax-priority', 'receive-fax', 'fax-to-email')
+        }
+
+        dynamodb = boto3.client('dynamodb')
+        self.tables = {}
+        for name in ('number-lookup', 'fax-dispatch', 'fax-retry', 'idempotency'):
+            dynamodb.create_table(
+                TableName=name,
+                BillingMode='PAY_PER_REQUEST',
+                AttributeDefinitions=[{'AttributeName': 'pk', 'AttributeType': 'S'}],
+                KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}]
+            )
+            self.tables[name] = name
+
+        index_names = ('line', 'direction', 'status', 'day')
+        dynamodb.create_table(
+            TableName='fax-ledger',
+            BillingMode='PAY_PER_REQUEST',
+            AttributeDefinitions=[
+                {'AttributeName': name, 'AttributeType': 'S'} for name in ('pk', 'at') + index_names
+            ],
+            KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}],
+            GlobalSecondaryIndexes=[
+                {
+                    'IndexName': name,
+                    'KeySchema': [
+                        {'AttributeName': name, 'KeyType': 'HASH'},
+                        {'AttributeName': 'at', 'KeyType': 'RANGE'}
+                    ],
+                    'Projection': {'ProjectionType': 'ALL'}
+                }
+                for name in index_names
+            ]
+        )
+        self.tables['fax-ledger'] = 'fax-ledger'
+
+        ssm = boto3.client('ssm')
+        parameters = {
+            '/prod/admin_email': admin_email,
+            '/prod/aws_email': aws_email,
+            '/prod/fax_emails': {fax_number: [sender_email]},
+            '/prod/twilio': {
+                'twilio_account_id': 'AC' + '0' * 32,
+                'twilio_api_key': 'bench',
+                'status_callback_url': 'https://bench.execute-api.us-west-2.amazonaws.com/Prod/fax/status'
+            },
+            '/prod/fax_to_email': {'source_email': aws_email, 'destination_email': admin_email},
+            '/prod/fax_routing': {fax_number: [admin_email, sender_email]},
+        }
+        for name, value in parameters.items():
+            ssm.put_parameter(Name=name, Value=json.dumps(value), Type='SecureString', Overwrite=True)
+        os.environ['CONFIG_PARAMETERS'] = ','.join(parameters)
+
+        ses = boto3.client('ses')
+        for address in (aws_email, admin_email, sender_email):
+            ses.verify_email_identity(EmailAddress=address)
+        for name in template_names:
+            ses.create_template(Template={
+                'TemplateName': name,
+                'SubjectPart': name,
+                'TextPart': '{{from_number}} {{to_number}} {{media_url}}',
+                'HtmlPart': '<p>{{from_number}} {{to_number}} {{media_url}}</p>'
+            })
+
+        apigateway = boto3.client('apigateway')
+        self.api_key_id = apigateway.create_api_key(name='bench', value=api_key_value, enabled=True)['id']
+
+        os.environ.update({
+            'BUCKET_NAME': send_bucket,
+            'SEND_FAX_QUEUE_URL': self.queues['send-fax'],
+            'SEND_FAX_PRIORITY_QUEUE_URL': self.queues['send-fax-priority'],
+            'FAX_TO_EMAIL_QUEUE_URL': self.queues['fax-to-email'],
+            'NUMBER_TABLE': self.tables['number-lookup'],
+            'DISPATCH_TABLE': self.tables['fax-dispatch'],
+            'RETRY_TABLE': self.tables['fax-retry'],
+            'IDEMPOTENCY_TABLE': self.tables['idempotency'],
+            'LEDGER_TABLE': self.tables['fax-ledger'],
+            # Every send_fax iteration goes to Twilio instead of waiting for the number's rate limit
+            'FAX_RATE_PER_MINUTE': '60000',
+            'FAX_BURST': '1000',
+            'RECORD_WORKERS': '1',
+        })
+
+    def put_object(self, bucket, key, body):
+        import boto3
+        boto3.client('s3').put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def failed_records(response):
+    '''
+    Records a handler reported as failed, or 1 for a failed API response.
+    '''
+    if not isinstance(response, dict):
+        return 0
+    if 'statusCode' in response:
+        return int(response['statusCode'] >= 500)
+    return len(response.get('batchItemFailures', []))
+
+
+def measure(env, name, iterations, prepare, invoke):
+    '''
+    Run prepare(i) untimed and invoke(prepared) timed for every iteration, then one traced
+    invocation for peak Python memory. Returns the result row of the scenario.
+    '''
+    latencies = []
+    failures = 0
+    env.reset_counters()
+    for i in range(iterations):
+        prepared = prepare(i)
+        env.counting = True
+        start = time.perf_counter()
+        response = invoke(prepared)
+        latencies.append((time.perf_counter() - start) * 1000)
+        env.counting = False
+        failures += failed_records(response)
+    aws_calls = Counter(env.aws_calls)
+    twilio_calls = Counter(env.twilio.requests)
+
+    prepared = prepare(iterations)
+    tracemalloc.start()
+    invoke(prepared)
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'scenario': name,
+        'iterations': iterations,
+        'failures': failures,
+        'p50_ms': percentile(latencies, 0.5),
+        'p90_ms': percentile(latencies, 0.9),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': max(latencies),
+        'aws_calls': {call: count / iterations for call, count in sorted(aws_calls.items())},
+        'twilio_calls': {call: count / iterations for call, count in sorted(twilio_calls.items())},
+        'peak_traced_mb': traced_peak / 1024 / 1024,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def bench_email_to_fax(env, iterations, pdf_mb):
+    import fixtures
+
+    os.environ['BUCKET_NAME'] = send_bucket
+    import email_to_fax
+
+    size = int(pdf_mb * 1024 * 1024)
+    email_bytes = fixtures.make_email(sender_email, destination_number, [size])
+
+    def prepare(i):
+        key = f"email-{i}"
+        env.put_object(email_bucket, key, email_bytes)
+        return fixtures.s3_event(email_bucket, [key])
+
+    return measure(env, f"email_to_fax[{pdf_mb}MB]", iterations, prepare,
+                   lambda event: email_to_fax.lambda_handler(event, None))
+
+
+def bench_send_fax(env, iterations, pdf_mb):
+    import fixtures
+    import fax_job
+    import send_fax
+
+    pdf = fixtures.make_pdf(int(pdf_mb * 1024 * 1024))
+
+    def prepare(i):
+        # A new object every time, the same job again would be skipped as a redelivery
+        env.put_object(send_bucket, f"fax-{i}.pdf", pdf)
+        job = fax_job.FaxJob(send_bucket, f"fax-{i}.pdf", fax_number, destination_number, from_email=sender_email)
+        return fixtures.sqs_event([job.to_json()])
+
+    return measure(env, 'send_fax', iterations, prepare, lambda event: send_fax.lambda_handler(event, None))
+
+
+def bench_receive_fax(env, iterations, pdf_mb):
+    import fixtures
+
+    os.environ['QUEUE_URL'] = env.queues['receive-fax']
+    import receive_fax
+
+    results = [
+        measure(env, 'receive_fax[/fax/check]', iterations, lambda i: fixtures.api_event('/fax/check'),
+                lambda event: receive_fax.lambda_handler(event, None)),
+        measure(env, 'receive_fax[/fax/receive]', iterations,
+                lambda i: fixtures.receive_webhook(f"FX{i:032d}", env.twilio.media_url(1024)),
+                lambda event: receive_fax.lambda_handler(event, None)),
+    ]
+
+    # Replay the status changes fake Twilio reports for a fax
+    import fake_twilio
+    statuses = iter(fake_twilio.fax_transitions * (iterations + 1))
+    results.append(measure(
+        env, 'receive_fax[/fax/status]', iterations,
+        lambda i: fixtures.status_webhook(f"FX{i // len(fake_twilio.fax_transitions):032d}", next(statuses)),
+        lambda event: receive_fax.lambda_handler(event, None)
+    ))
+
+    # Page through the ledger events the webhooks above recorded for the fax number
+    results.append(measure(
+        env, 'receive_fax[/fax/history]', iterations,
+        lambda i: fixtures.history_event({'number': '+15555550100', 'limit': '50'}),
+        lambda event: receive_fax.lambda_handler(event, None)
+    ))
+    return results
+
+
+def bench_fetch_fax(env, iterations, pdf_mb):
+    import fixtures
+
+    os.environ['BUCKET_NAME'] = receive_bucket
+    import fetch_fax
+
+    size = int(pdf_mb * 1024 * 1024)
+    env.twilio.pdf(size)
+
+    def prepare(i):
+        return fixtures.sqs_event([json.dumps({
+            'fax_sid': f"FX{time.time_ns()}{i}",
+            'to_number': fax_number,
+            'from_number': destination_number,
+            'pages': '1',
+            'media_url': env.twilio.media_url(size)
+        })])
+
+    return measure(env, f"fetch_fax[{pdf_mb}MB]", iterations, prepare,
+                   lambda event: fetch_fax.lambda_handler(event, None))
+
+
+def bench_fax_to_email(env, iterations, pdf_mb):
+    import fixtures
+    import fax_job
+    import fax_to_email
+
+    pdf = fixtures.make_pdf(1024)
+
+    def prepare(i):
+        env.put_object(receive_bucket, f"Fax_bench{i}.pdf", pdf)
+        job = fax_job.FaxJob(receive_bucket, f"Fax_bench{i}.pdf", destination_number, fax_number, pages='1')
+        return fixtures.sqs_event([job.to_json()])
+
+    return measure(env, 'fax_to_email', iterations, prepare, lambda event: fax_to_email.lambda_handler(event, None))
+
+
+def bench_api_authorizer(env, iterations, pdf_mb):
+    import api_authorizer
+
+    def prepare(i):
+        return {'queryStringParameters': {'id': env.api_key_id, 'key': api_key_value}}
+
+    return measure(env, 'api_authorizer', iterations, prepare,
+                   lambda event: api_authorizer.lambda_handler(event, None))
+
+
+scenarios = {
+    'email_to_fax': (bench_email_to_fax, True),
+    'send_fax': (bench_send_fax, False),
+    'receive_fax': (bench_receive_fax, False),
+    'fetch_fax': (bench_fetch_fax, True),
+    'fax_to_email': (bench_fax_to_email, False),
+    'api_authorizer': (bench_api_authorizer, False),
+}
+
+
+def run_scenario(name, iterations, pdf_mb, queue):
+    try:
+        env = Environment()
+        result = scenarios[name][0](env, iterations, pdf_mb)
+        queue.put(result if isinstance(result, list) else [result])
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        queue.put([{'scenario': name, 'error': repr(e)}])
+
+
+def print_results(results):
+    print(
+        f"\n{'scenario':<28}{'failed':>7}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'traced MB':>11}{'rss MB':>9}"
+        "  calls per invocation"
+    )
+    for result in results:
+        if 'error' in result:
+            print(f"{result['scenario']:<28}  FAILED {result['error']}")
+            continue
+        calls = ', '.join(
+            f"{call} {count:g}" for call, count in list(result['aws_calls'].items()) + [
+                (f"twilio.{call}", count) for call, count in result['twilio_calls'].items()
+            ]
+        )
+        print(
+            f"{result['scenario']:<28}{result['failures']:>7}{result['p50_ms']:>9.1f}{result['p90_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+            f"{result['peak_traced_mb']:>11.1f}{result['peak_rss_mb']:>9.1f}  {calls}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='*', default=list(scenarios), choices=list(scenarios))
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--pdf-mb', default='1,10,50', help='comma separated PDF sizes for the email and media scenarios')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    sizes = [float(size) for size in args.pdf_mb.split(',')]
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name in args.scenarios:
+        for pdf_mb in sizes if scenarios[name][1] else sizes[:1]:
+            # A fresh process per scenario, so peak memory and caches belong to that scenario only
+            queue = context.Queue()
+            process = context.Process(target=run_scenario, args=(name, args.iterations, pdf_mb, queue))
+            process.start()
+            results.extend(queue.get())
+            process.join()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    # Failed records run a different code path, so their timings can't be compared
+    if any('error' in result or result['failures'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
 import json
+import os
+import sys
+
 import yaml
 
-import boto3
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Create AWS clients with the same session and settings as the Lambda functions
+sys.path.insert(0, os.path.join(os.path.dirname(scripts_dir), 'app'))
+import clients  # noqa: E402
 
-ssm_client = boto3.client('ssm')
-cf_client = boto3.resource('cloudformation')
-ses_client = boto3.client('ses')
+ssm_client = clients.client('ssm')
+cf_client = clients.resource('cloudformation')
+ses_client = clients.client('ses')
 
 
 def create_ssm_param(param):
@@ -99,10 +106,11 @@ def main():
             print(json.dumps(verify_response, sort_keys=True, indent=4))
 
         if param['name'] == '/prod/fax_emails':
-            for email in param['value'].items():
-                verify_response = verify_email(email[1])
-                print(f"\nAttempted verifying email for {param['value']}")
-                print(json.dumps(verify_response, sort_keys=True, indent=4))
+            for emails in param['value'].values():
+                for email in [emails] if isinstance(emails, str) else emails:
+                    verify_response = verify_email(email)
+                    print(f"\nAttempted verifying email for {email}")
+                    print(json.dumps(verify_response, sort_keys=True, indent=4))
 
 
 if __name__ == "__main__":
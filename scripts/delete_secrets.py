@@ -1,9 +1,17 @@
-import boto3
 import json
+import os
+import sys
+
 import yaml
 
-ssm_client = boto3.client('ssm')
-ses_client = boto3.client('ses')
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Create AWS clients with the same session and settings as the Lambda functions
+sys.path.insert(0, os.path.join(os.path.dirname(scripts_dir), 'app'))
+import clients  # noqa: E402
+
+ssm_client = clients.client('ssm')
+ses_client = clients.client('ses')
 
 
 def main():
@@ -37,10 +45,11 @@ def main():
             print(json.dumps(delete_identity_response, sort_keys=True, indent=4))
 
         if param['name'] == '/prod/fax_emails':
-            for email in param['value'].items():
-                delete_identity_response = ses_client.delete_identity(Identity=email[1])
-                print(f"\nAttempted deleting email identity for {param['value']}")
-                print(json.dumps(delete_identity_response, sort_keys=True, indent=4))
+            for emails in param['value'].values():
+                for email in [emails] if isinstance(emails, str) else emails:
+                    delete_identity_response = ses_client.delete_identity(Identity=email)
+                    print(f"\nAttempted deleting email identity for {email}")
+                    print(json.dumps(delete_identity_response, sort_keys=True, indent=4))
 
 
 if __name__ == "__main__":
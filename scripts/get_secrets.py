@@ -1,8 +1,16 @@
-import boto3
 import json
+import os
+import sys
+
 import yaml
 
-client = boto3.client('ssm')
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Create AWS clients with the same session and settings as the Lambda functions
+sys.path.insert(0, os.path.join(os.path.dirname(scripts_dir), 'app'))
+import clients  # noqa: E402
+
+client = clients.client('ssm')
 
 
 def main():
@@ -14,7 +22,7 @@ def main():
         print(json.dumps(ssm_response, sort_keys=True, indent=4, default=str))
 
         if param['name'] == '/prod/aws_email':
-            ses_client = boto3.client('ses', param['aws_region'])
+            ses_client = clients.client('ses', param['aws_region'])
             ses_response = ses_client.describe_active_receipt_rule_set()
             rule_set_name = ses_response['Metadata']['Name']
             print(json.dumps(ses_response['Metadata'], sort_keys=True, indent=4, default=str))
@@ -0,0 +1,86 @@
+'''
+Measure the import time of every Lambda handler in app/ with python -X importtime.
+Prints the heaviest imports of each handler and exits with status 1 if a handler
+takes longer to import than its budget in import_budget.json, in milliseconds.
+
+Usage: python scripts/import_budget.py [--top 10] [--runs 3] [handler ...]
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+scripts_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(os.path.dirname(scripts_dir), 'app')
+
+
+def measure(module):
+    '''
+    Import a module in a fresh interpreter and return {imported module: (self us, cumulative us)}.
+    '''
+    env = dict(
+        os.environ,
+        AWS_REGION='us-west-2',
+        AWS_DEFAULT_REGION='us-west-2',
+        PYTHONDONTWRITEBYTECODE='1'
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=app_dir,
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        raise RuntimeError(f"Unable to import {module}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('handlers', nargs='*', help='handler modules to measure, defaults to every budgeted handler')
+    parser.add_argument('--top', type=int, default=10, help='number of heaviest imports to print per handler')
+    parser.add_argument('--runs', type=int, default=3, help='imports per handler, the fastest one is reported')
+    parser.add_argument('--budget', default=os.path.join(scripts_dir, 'import_budget.json'))
+    args = parser.parse_args()
+
+    with open(args.budget) as f:
+        budget = json.load(f)
+
+    over_budget = []
+    for handler in args.handlers or sorted(budget):
+        runs = [measure(handler) for _ in range(args.runs)]
+        timings = min(runs, key=lambda run: run[handler][1])
+        total_ms = timings[handler][1] / 1000
+        limit_ms = budget.get(handler)
+
+        status = 'ok'
+        if limit_ms is not None and total_ms > limit_ms:
+            status = 'OVER BUDGET'
+            over_budget.append(handler)
+        print(f"\n{handler}: {total_ms:.1f} ms (budget {limit_ms} ms) {status}")
+
+        heaviest = sorted(
+            (item for item in timings.items() if item[0] != handler and item[1][1] <= timings[handler][1]),
+            key=lambda item: item[1][1],
+            reverse=True
+        )
+        for name, (self_us, cumulative_us) in heaviest[:args.top]:
+            print(f"  {cumulative_us / 1000:8.1f} ms cumulative {self_us / 1000:8.1f} ms self  {name}")
+
+    if over_budget:
+        print(f"\nOver import budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()